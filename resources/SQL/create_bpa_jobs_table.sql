@@ -0,0 +1,22 @@
+/* SQL script for create table with BPA extraction jobs (workers queue) */
+CREATE TABLE bpa_jobs (
+	id serial PRIMARY KEY,
+	source VARCHAR (20) NOT NULL,
+	bpa_date DATE NOT NULL,
+	kind VARCHAR (10) NOT NULL DEFAULT 'live',
+	status VARCHAR (10) NOT NULL DEFAULT 'pending',
+	attempts INT NOT NULL DEFAULT 0,
+	max_attempts INT NOT NULL DEFAULT 3,
+	run_after TIMESTAMP NOT NULL DEFAULT now(),
+	lease_until TIMESTAMP,
+	worker VARCHAR (80),
+	last_error TEXT,
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+/* Only one active job for each source and date */
+CREATE UNIQUE INDEX bpa_jobs_active_idx ON bpa_jobs (source, bpa_date) WHERE status IN ('pending', 'running');
+
+/* Jobs ready to be claimed by workers */
+CREATE INDEX bpa_jobs_claim_idx ON bpa_jobs (run_after) WHERE status IN ('pending', 'running');
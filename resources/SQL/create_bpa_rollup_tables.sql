@@ -0,0 +1,41 @@
+/* SQL script for create rollup tables with danger level statistics */
+
+/* Effective (max) danger level for each zone and day */
+CREATE TABLE bpa_daily_levels (
+	zone_id VARCHAR (10) NOT NULL,
+	bpa_date DATE NOT NULL,
+	zone_name VARCHAR (80) NOT NULL,
+	danger_level INT NOT NULL,
+	updated_at TIMESTAMP NOT NULL,
+	PRIMARY KEY (zone_id, bpa_date)
+);
+
+/* Statistics for each zone and season (Ex: 2024-2025, from September to August) */
+CREATE TABLE bpa_season_stats (
+	zone_id VARCHAR (10) NOT NULL,
+	season VARCHAR (9) NOT NULL,
+	zone_name VARCHAR (80) NOT NULL,
+	days INT NOT NULL,
+	days_level_1 INT NOT NULL,
+	days_level_2 INT NOT NULL,
+	days_level_3 INT NOT NULL,
+	days_level_4 INT NOT NULL,
+	days_level_5 INT NOT NULL,
+	first_day_high DATE,
+	last_day_high DATE,
+	level_changes INT NOT NULL,
+	updated_at TIMESTAMP NOT NULL,
+	PRIMARY KEY (zone_id, season)
+);
+
+/* Statistics for each zone and month */
+CREATE TABLE bpa_monthly_stats (
+	zone_id VARCHAR (10) NOT NULL,
+	month DATE NOT NULL,
+	zone_name VARCHAR (80) NOT NULL,
+	days INT NOT NULL,
+	max_level INT NOT NULL,
+	level_changes INT NOT NULL,
+	updated_at TIMESTAMP NOT NULL,
+	PRIMARY KEY (zone_id, month)
+);
@@ -0,0 +1,20 @@
+/* SQL script for create table with extractor runs (run ledger) */
+CREATE TABLE extractor_runs (
+	id serial PRIMARY KEY,
+	source VARCHAR (20) NOT NULL,
+	host VARCHAR (80),
+	started_at TIMESTAMP NOT NULL,
+	finished_at TIMESTAMP NOT NULL,
+	duration_seconds REAL NOT NULL,
+	stage_durations JSONB,
+	bytes_fetched BIGINT,
+	http_status INT,
+	cache_hits INT NOT NULL DEFAULT 0,
+	zones_parsed INT NOT NULL DEFAULT 0,
+	rows_written INT NOT NULL DEFAULT 0,
+	outcome VARCHAR (15) NOT NULL,
+	error TEXT,
+	content_hash VARCHAR (64)
+);
+
+CREATE INDEX extractor_runs_source_started_idx ON extractor_runs (source, started_at);
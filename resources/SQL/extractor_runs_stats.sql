@@ -0,0 +1,36 @@
+/* Duration percentiles (p50/p95) and outcomes for each source and week */
+SELECT
+	source,
+	date_trunc('week', started_at)::date AS week,
+	COUNT(*) AS runs,
+	percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_seconds) AS p50_seconds,
+	percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_seconds) AS p95_seconds,
+	COUNT(*) FILTER (WHERE outcome = 'no_change') AS no_change_runs,
+	COUNT(*) FILTER (WHERE outcome IN ('failed', 'unavailable')) AS failed_runs,
+	SUM(bytes_fetched) AS bytes_fetched
+FROM
+	extractor_runs
+GROUP BY
+	source,
+	week
+ORDER BY
+	source,
+	week;
+
+/* Stage duration percentiles (p50/p95) for each source in the last 30 days */
+SELECT
+	source,
+	stage.key AS stage,
+	percentile_cont(0.5) WITHIN GROUP (ORDER BY stage.value::real) AS p50_seconds,
+	percentile_cont(0.95) WITHIN GROUP (ORDER BY stage.value::real) AS p95_seconds
+FROM
+	extractor_runs,
+	jsonb_each_text(stage_durations) AS stage
+WHERE
+	started_at >= now() - interval '30 days'
+GROUP BY
+	source,
+	stage.key
+ORDER BY
+	source,
+	stage.key;
@@ -10,10 +10,14 @@
 #    * CUSTOM_DATE: Select a specific date for BPA report
 #                   extractors. Default Today.
 #                   Format: YYYY-MM-DD
+#                   Pre-flight planner is skipped if it's set.
 #    * CUSTOM_ZONE: Select a specific zone that you want to
 #                   extract BPA report and update data.
 #                   If it's not set, all zones will be updated.
 #                   Zones: andorra,aran,icgc,meteofrance.
+#    * FORCE_REFRESH: Run all extractors even if BPA data is
+#                     already stored or out of bulletin season.
+#                     Default false.
 #
 #   Collaborators:
 #       * Nil Torrano: <ntorrano@atesmaps.org>
@@ -29,10 +33,21 @@ AVAILABLE_ZONES="andorra aran icgc meteofrance aragon_navarra"
 
 printf "\nRunning ATESMaps BPA extractors...\n"
 
-# If no zone is specified, all will be executed.
+# If no zone is specified, all zones with pending BPA data will be executed.
 if [[ -z "${CUSTOM_ZONE}" ]];
 	then
-        for zone in ${AVAILABLE_ZONES}; do
+        # Pre-flight planner (only for today). If it fails, all zones will be executed.
+        if [[ -n "${CUSTOM_DATE}" ]]; then
+            printf "\nCustom date '%s'. Pre-flight planner skipped.\n" "${CUSTOM_DATE}"
+            PLANNED_ZONES="${AVAILABLE_ZONES}"
+        elif ! PLANNED_ZONES=$(python3 -u /src/bpa_planner.py); then
+            printf "\nPre-flight planner failed. All zones will be executed.\n"
+            PLANNED_ZONES="${AVAILABLE_ZONES}"
+        fi
+        if [[ -z "${PLANNED_ZONES}" ]]; then
+            printf "\nNothing to do. BPA data is up to date.\n"
+        fi
+        for zone in ${PLANNED_ZONES}; do
             printf "\nRunning BPA extractor for zone '%s'...\n" "${zone}"
             python3 -u /src/bpa_${zone}.py
         done
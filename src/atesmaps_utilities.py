@@ -12,10 +12,9 @@
 #   November 2021
 #
 ############################################################
-from datetime import datetime
+from typing import Dict, List
 
-import constants as const
-import db_connector as db
+import storage
 
 
 def refresh_zone_ids() -> dict:
@@ -24,13 +23,7 @@ def refresh_zone_ids() -> dict:
     and zone ID.
     """
 
-    q = f"SELECT zona, codi_zona FROM {const.TABLE_BPA}"
-    response = db.select_data(query=q)
-    zone_ids = {}
-    for rec in response:
-        zone_ids[rec[0]] = rec[1]
-
-    return zone_ids
+    return storage.get_zone_ids()
 
 
 def bpa_exists(date: str, zone_id: str, danger_level: int) -> bool:
@@ -44,25 +37,23 @@ def bpa_exists(date: str, zone_id: str, danger_level: int) -> bool:
     :param danger_level: Avalanche danger level as string. Ex: 2
     """
 
-    q = f"""SELECT
-                id
-            FROM
-                {const.TABLE_BPA_HISTORY}
-            WHERE
-                bpa_date = '{date}'
-                and zone_id = '{zone_id}'
-                and danger_level = '{danger_level}'"""
+    return storage.bpa_exists(date=date, zone_id=zone_id, danger_level=danger_level)
+
 
-    response = db.select_data(query=q)
-    if response:
-        return True
+def save_levels(levels: List[Dict]) -> int:
+    """
+    Save danger levels of several zones into database in a single
+    transaction. Return the number of new danger levels saved.
+
+    :param levels: List of dictionaries with zone_name, zone_id, date (YYYY-MM-DD) and level.
+    """
 
-    return False
+    return storage.save_levels(levels=levels)
 
 
-def save_data(zone_name: str, zone_id: str, date: str, level: str) -> None:
+def save_data(zone_name: str, zone_id: str, date: str, level: str) -> bool:
     """
-    Save data into database.
+    Save data into database. Return True if new data has been saved.
 
     :param zone_name: The name of the zone to save data.
     :param zone_id: The zone code that identifies uniquely zone.
@@ -70,24 +61,7 @@ def save_data(zone_name: str, zone_id: str, date: str, level: str) -> None:
     :param level: Avalanche danger level as string. Ex: 2
     """
 
-    print(
-        f"Adding danger level '{level}' for zone '{zone_name}' using date '{date}' to database..."
-    )
-
-    # Check if BPA data is already saved in the database
-    if bpa_exists(date=date, zone_id=zone_id, danger_level=level):
-        print("The BPA data is already in the database. Nothing to do.")
-        return
-
-    # Insert danger level to BPA table
-    print(f"Updating data to zones information table for zone '{zone_name}'...")
-    q = f"UPDATE {const.TABLE_BPA} SET bpa='{level}', actualitzacio='{datetime.now()}' WHERE codi_zona = '{zone_id}'"
-    db.update_data(query=q)
-
-    # Insert data into BPA history
-    print(f"Inserting new data to bpa history table for zone '{zone_name}'...")
-    q = (
-        f"INSERT INTO {const.TABLE_BPA_HISTORY} (zone_name, zone_id, created_at, danger_level, bpa_date) "
-        f"VALUES ('{zone_name}', '{zone_id}', '{datetime.now()}', '{level}', '{date}')"
-    )
-    db.update_data(query=q)
+    levels = [
+        {"zone_name": zone_name, "zone_id": zone_id, "date": date, "level": level}
+    ]
+    return save_levels(levels=levels) > 0
@@ -26,6 +26,9 @@ from bs4 import BeautifulSoup
 
 import atesmaps_utilities as ates_utils
 import bpa_urls
+import geojson_snapshot
+import profiling
+import run_ledger
 
 # ----- CONFIGURATION ----- #
 ANDORRA_ZONES = {
@@ -43,6 +46,7 @@ def get_bpa_html():
 
     print("Obtaining Andorra BPA report html...")
     response = requests.get(url=bpa_urls.BPA_ANDORRA_URL)
+    run_ledger.record_response(response=response)
     # Parsing html content with beautifulsoup
     if response.status_code != 200:
         print("Andorra avalanche reporting web is not available.")
@@ -75,6 +79,7 @@ def get_report(download_link: str, output_file: str) -> None:
     try:
         print(f"Downloading Andorra BPA report from: {download_link}...")
         response = requests.get(url=download_link)
+        run_ledger.record_response(response=response, bulletin=True)
         if response.status_code != 200:
             print("Avalanche report for Andorra zone is not available.")
             sys.exit(1)
@@ -150,25 +155,39 @@ def main() -> None:
 
     # Get danger level
     pdf_bpa = f"/tmp/andorra_bpa_{today}.pdf"
-    report_url = get_download_link()
-    get_report(download_link=report_url, output_file=pdf_bpa)
+    with profiling.stage(source="andorra", name="fetch"):
+        report_url = get_download_link()
+        get_report(download_link=report_url, output_file=pdf_bpa)
 
     # Get danger levels from BPA
-    danger_lvls = get_bpa_danger_levels()
+    with profiling.stage(source="andorra", name="parse"):
+        danger_lvls = get_bpa_danger_levels()
 
     # Insert data to DB
-    for zone in danger_lvls:
-        ates_utils.save_data(
-            zone_name=zone["zone_name"],
-            zone_id=zone["zone_id"],
-            date=today,
-            level=zone["level"],
+    with profiling.stage(source="andorra", name="save"):
+        rows_written = ates_utils.save_levels(
+            levels=[
+                {
+                    "zone_name": zone["zone_name"],
+                    "zone_id": zone["zone_id"],
+                    "date": today,
+                    "level": zone["level"],
+                }
+                for zone in danger_lvls
+            ]
         )
 
+    run_ledger.record_levels(zones_parsed=len(danger_lvls), rows_written=rows_written)
+
+    # Update GeoJSON snapshot with new danger levels
+    if rows_written:
+        geojson_snapshot.write_snapshot()
+
     # End
     print("Total time elapsed: {:.2f} seconds.".format(time.time() - start_time))
     print("Bye.")
 
 
 # Trigger
-main()
+with run_ledger.track(source="andorra"):
+    main()
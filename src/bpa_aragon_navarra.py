@@ -19,14 +19,19 @@ import sys
 import time
 from datetime import datetime
 
-import fitz
-import requests
-
 import atesmaps_utilities as ates_utils
 import bpa_urls
+import geojson_snapshot
+import pdf_extraction as pdf
+import profiling
+import remote_pdf
+import run_ledger
 
 # ----- CONFIGURATION ----- #
 ARAGON_NAV_ZONES = ["Navarra", "Jacetania", "Gállego", "Sobrarbe", "Ribagorza"]
+ARAGON_NAV_CLIP = None  # Full page
+# Pages downloaded with HTTP range requests (None = full PDF)
+ARAGON_NAV_PAGES = None
 
 # ----- Avalanche Levels ----- #
 AVALANCHE_LEVELS = {
@@ -49,13 +54,16 @@ def get_report(output_file: str) -> None:
         print(
             f"Downloading Aragon-Navarra BPA report from: {bpa_urls.BPA_ARAGON_NAV_URL}..."
         )
-        response = requests.get(url=bpa_urls.BPA_ARAGON_NAV_URL)
-        if response.status_code != 200:
+        status, content = remote_pdf.fetch_pdf(
+            url=bpa_urls.BPA_ARAGON_NAV_URL, pages=ARAGON_NAV_PAGES
+        )
+        if status != 200:
             print("Avalanche report for Aragon & Navarra zones is not available.")
             sys.exit(1)
+        run_ledger.record_content(content=content)
         # Download report as PDF
         with open(output_file, "wb") as f:
-            f.write(response.content)
+            f.write(content)
         return
     except Exception as exc:
         raise Exception("Couldn't get Aragon-Navarra BPA.") from exc
@@ -70,9 +78,14 @@ def get_danger_levels_from_bpa(bpa_file: str) -> int:
 
     print("Obtaining danger levels from BPA report...")
     levels_from_bpa = []
-    with fitz.open(bpa_file) as f:
-        for page in f:
-            p_text = page.get_text().split("\n")
+    with pdf.open_pdf(pdf_file=bpa_file) as doc:
+        pages_text = pdf.extract_lines(
+            doc=doc,
+            pages=ARAGON_NAV_PAGES,
+            clip=ARAGON_NAV_CLIP,
+            needles=ARAGON_NAV_ZONES,
+        )
+        for p_text in pages_text.values():
             for index, line_text in enumerate(p_text):
                 if line_text in ARAGON_NAV_ZONES:
                     # Get zone ID from zone name
@@ -107,24 +120,38 @@ def main() -> None:
 
     # Get danger level
     pdf_bpa = f"/tmp/aragon_nav_bpa_{today}.pdf"
-    get_report(output_file=pdf_bpa)
+    with profiling.stage(source="aragon_navarra", name="fetch"):
+        get_report(output_file=pdf_bpa)
 
     # Get danger levels from BPA
-    danger_lvls = get_danger_levels_from_bpa(bpa_file=pdf_bpa)
+    with profiling.stage(source="aragon_navarra", name="parse"):
+        danger_lvls = get_danger_levels_from_bpa(bpa_file=pdf_bpa)
 
     # Insert data to DB
-    for zone in danger_lvls:
-        ates_utils.save_data(
-            zone_name=zone["zone_name"],
-            zone_id=zone["zone_id"],
-            date=today,
-            level=zone["level"],
+    with profiling.stage(source="aragon_navarra", name="save"):
+        rows_written = ates_utils.save_levels(
+            levels=[
+                {
+                    "zone_name": zone["zone_name"],
+                    "zone_id": zone["zone_id"],
+                    "date": today,
+                    "level": zone["level"],
+                }
+                for zone in danger_lvls
+            ]
         )
 
+    run_ledger.record_levels(zones_parsed=len(danger_lvls), rows_written=rows_written)
+
+    # Update GeoJSON snapshot with new danger levels
+    if rows_written:
+        geojson_snapshot.write_snapshot()
+
     # End
     print("Total time elapsed: {:.2f} seconds.".format(time.time() - start_time))
     print("Bye.")
 
 
 # Trigger
-main()
+with run_ledger.track(source="aragon_navarra"):
+    main()
@@ -15,53 +15,75 @@
 #   November 2021
 #
 ############################################################
-import sys
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Dict, List, Optional
 
 import requests
 from bs4 import BeautifulSoup
 
 import atesmaps_utilities as ates_utils
 import bpa_urls
+import date_window
+import geojson_snapshot
+import profiling
+import run_ledger
+import settings
 
 # ----- CONFIGURATION ----- #
 ZONE_NAME = "Aran"
 
 
-def get_report(date: str):
+def get_report(date: str, headers: Optional[Dict[str, str]] = None):
     """
-    Do an API call and return BPA data in BeautifulSoup object.
+    Do an API call and return HTTP response with the BPA report.
+    Return None if the BPA report is not available.
 
-    :param date: Select specific date for BPA. Default today.
-                 Format: YYYY-MM-DD
+    :param date: Select specific date for BPA. Format: YYYY-MM-DD
+    :param headers: Headers of the bulletin probe (not used, see date_window.fetch_new).
     """
 
     try:
-        print("Downloading Aran BPA report...")
-
-        # Check if BPA report for tomorrow are available
-        selected_date = datetime.strptime(date, "%Y-%m-%d")
-        tomorrow = (selected_date + timedelta(days=1)).strftime("%Y-%m-%d")
-        print(f"Checking if BPA report are available for tomorrow '{tomorrow}'...")
-        response = requests.get(url=bpa_urls.BPA_ARAN_URL.format(date=tomorrow))
-        # Parsing html content with beautifulsoup
+        print(f"Downloading Aran BPA report for date '{date}'...")
+        response = requests.get(url=bpa_urls.BPA_ARAN_URL.format(date=date))
+        run_ledger.record_response(response=response)
         if response.status_code != 200:
             print(
-                f"Avalanche report for zone Aran using date {tomorrow} is not available yet."
+                f"Avalanche report for zone Aran using date {date} is not available yet."
             )
-            print(f"Checking BPA report for current date '{date}'...")
-            response = requests.get(url=bpa_urls.BPA_ARAN_URL.format(date=date))
-            if response.status_code != 200:
-                print(
-                    f"Avalanche report for zone Aran using date {date} is not available yet."
-                )
-                sys.exit(1)
-        return BeautifulSoup(response.text, "html.parser")
+            return
+        return response
     except Exception as exc:
         raise Exception("Couldn't get Aran BPA.") from exc
 
 
+def get_reports(date: str) -> List:
+    """
+    Return new BPA reports (not stored yet) published for the dates
+    around selected date (yesterday, today and tomorrow) as BeautifulSoup
+    objects. Available dates are probed concurrently.
+
+    :param date: Select specific date for BPA. Format: YYYY-MM-DD
+    """
+
+    responses = date_window.fetch_new(
+        url_template=bpa_urls.BPA_ARAN_URL,
+        date=date,
+        zone_names=[ZONE_NAME],
+        fetch=get_report,
+        force=settings.FORCE_REFRESH,
+    )
+
+    reports = []
+    for report_date in sorted(responses):
+        if responses[report_date] is not None:
+            run_ledger.record_content(content=responses[report_date].content)
+            # Parsing html content with beautifulsoup
+            reports.append(BeautifulSoup(responses[report_date].text, "html.parser"))
+
+    return reports
+
+
 def get_bpa_publication_date(bpa) -> str:
     """
     Return BPA date from report.
@@ -78,7 +100,8 @@ def get_bpa_publication_date(bpa) -> str:
         bpa_date_container = bpa.body.find_all("div", attrs={"class": "bTitle"})[0].text
         locale.setlocale(locale.LC_TIME, "ca_ES.UTF-8")  # Aran BPA is in Catalan
         bpa_date_obj = datetime.strptime(
-            bpa_date_container.encode("latin1").decode("utf-8").split(",")[1].strip(), "%d %B de %Y"
+            bpa_date_container.encode("latin1").decode("utf-8").split(",")[1].strip(),
+            "%d %B de %Y",
         )
         bpa_date = bpa_date_obj.strftime("%Y-%m-%d")
 
@@ -121,8 +144,8 @@ def main() -> None:
     start_time = time.time()
     print("** ATESMaps Avalanche Report Extractor **")
 
-    # Today date in format YYYY-MM-DD
-    today = datetime.today().strftime("%Y-%m-%d")
+    # Today date (or CUSTOM_DATE) in format YYYY-MM-DD
+    today = settings.CUSTOM_DATE or datetime.today().strftime("%Y-%m-%d")
 
     print("Updating avalanche danger level...")
     print(f"Zone: {ZONE_NAME}")
@@ -131,20 +154,36 @@ def main() -> None:
     # Load zone ID for Aran
     zone_id = ates_utils.refresh_zone_ids()[ZONE_NAME]
 
-    # Get BPA date from report
-    report = get_report(date=today)
-    bpa_date = get_bpa_publication_date(bpa=report)
-
-    # Check if BPA danger levels for BPA report date already exists.
-    print(f"BPA report date: {bpa_date}")
-
-    # Get danger level
-    danger_lvl = danger_level_from_bpa(bpa=report)
+    # Get new BPA reports
+    with profiling.stage(source="aran", name="fetch"):
+        reports = get_reports(date=today)
+
+    levels = []
+    with profiling.stage(source="aran", name="parse"):
+        for report in reports:
+            # Get BPA date from report
+            bpa_date = get_bpa_publication_date(bpa=report)
+            print(f"BPA report date: {bpa_date}")
+
+            # Get danger level
+            danger_lvl = danger_level_from_bpa(bpa=report)
+            levels.append(
+                {
+                    "zone_name": ZONE_NAME,
+                    "zone_id": zone_id,
+                    "date": bpa_date,
+                    "level": danger_lvl,
+                }
+            )
 
     # Insert data to DB
-    ates_utils.save_data(
-        zone_name=ZONE_NAME, zone_id=zone_id, date=bpa_date, level=danger_lvl
-    )
+    with profiling.stage(source="aran", name="save"):
+        rows_written = ates_utils.save_levels(levels=levels)
+    run_ledger.record_levels(zones_parsed=len(levels), rows_written=rows_written)
+
+    # Update GeoJSON snapshot with new danger levels
+    if rows_written:
+        geojson_snapshot.write_snapshot()
 
     # End
     print("Total time elapsed: {:.2f} seconds.".format(time.time() - start_time))
@@ -152,4 +191,5 @@ def main() -> None:
 
 
 # Trigger
-main()
+with run_ledger.track(source="aran"):
+    main()
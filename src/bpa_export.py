@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - History Export
+#
+#   Python script that exports BPA history as CSV or NDJSON
+#   (one JSON record per line). Records are streamed from
+#   the database with a server-side cursor (or COPY TO
+#   STDOUT), so memory usage doesn't depend on table size.
+#
+#   Usage: python3 bpa_export.py [--format csv|ndjson] [--copy]
+#              [--zone ZONE_ID] [--source SOURCE]
+#              [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+#              [--output FILE]
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+from typing import IO, List, Optional
+
+import constants as const
+import db_connector as db
+
+# ----- CONFIGURATION ----- #
+EXPORT_COLUMNS = ["zone_id", "zone_name", "bpa_date", "danger_level", "created_at"]
+EXPORT_FORMATS = ["csv", "ndjson"]
+
+
+def log(message: str) -> None:
+    """
+    Print log message to stderr. Stdout can be used for the export.
+
+    :param message: Message to print.
+    """
+
+    print(message, file=sys.stderr)
+
+
+def export_query(
+    zones: Optional[List[str]] = None,
+    sources: Optional[List[str]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> str:
+    """
+    Return SQL query with BPA history records filtered by zone,
+    source and date range.
+
+    :param zones: Zone codes that identify uniquely zones.
+    :param sources: BPA source names. Ex: ["icgc"]
+    :param start: First BPA date in format YYYY-MM-DD.
+    :param end: Last BPA date in format YYYY-MM-DD.
+    """
+
+    conditions = []
+    if zones:
+        zone_ids = "', '".join(zone.replace("'", "''") for zone in zones)
+        conditions.append(f"zone_id IN ('{zone_ids}')")
+    if sources:
+        zone_names = "', '".join(
+            zone.replace("'", "''")
+            for source in sources
+            for zone in const.SOURCE_ZONES[source]
+        )
+        conditions.append(f"zone_name IN ('{zone_names}')")
+    if start:
+        conditions.append(f"bpa_date >= '{start}'")
+    if end:
+        conditions.append(f"bpa_date <= '{end}'")
+
+    return f"""SELECT
+                {', '.join(EXPORT_COLUMNS)}
+            FROM
+                {const.TABLE_BPA_HISTORY}
+            WHERE
+                {' AND '.join(conditions) or 'TRUE'}
+            ORDER BY
+                bpa_date, zone_id, created_at"""
+
+
+def write_csv(query: str, output: IO) -> int:
+    """
+    Write query records to output as CSV and return the number of records.
+
+    :param query: String with SQL select query.
+    :param output: Writable text file object.
+    """
+
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for record in db.stream_data(query=query):
+        writer.writerow(
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in record
+        )
+        count += 1
+
+    return count
+
+
+def write_ndjson(query: str, output: IO) -> int:
+    """
+    Write query records to output as NDJSON (one JSON object per line)
+    and return the number of records.
+
+    :param query: String with SQL select query.
+    :param output: Writable text file object.
+    """
+
+    count = 0
+    for record in db.stream_data(query=query):
+        line = json.dumps(
+            dict(zip(EXPORT_COLUMNS, record)),
+            default=lambda value: value.isoformat(),
+            ensure_ascii=False,
+        )
+        output.write(f"{line}\n")
+        count += 1
+
+    return count
+
+
+def export(
+    query: str, output: IO, export_format: str = "csv", copy: bool = False
+) -> Optional[int]:
+    """
+    Export query records to output and return the number of records
+    (None if COPY TO STDOUT is used).
+
+    :param query: String with SQL select query.
+    :param output: Writable text file object.
+    :param export_format: Output format (csv or ndjson).
+    :param copy: Use COPY TO STDOUT (only for CSV).
+    """
+
+    if copy:
+        if export_format != "csv":
+            raise Exception("COPY TO STDOUT export is only available for CSV format.")
+        db.copy_to(query=query, file=output)
+        return
+
+    if export_format == "ndjson":
+        return write_ndjson(query=query, output=output)
+
+    return write_csv(query=query, output=output)
+
+
+def main() -> None:
+    """Export BPA history."""
+
+    parser = argparse.ArgumentParser(description="ATESMaps BPA history export")
+    parser.add_argument(
+        "--format", choices=EXPORT_FORMATS, default="csv", dest="export_format"
+    )
+    parser.add_argument(
+        "--copy", action="store_true", help="Use COPY TO STDOUT (only CSV)."
+    )
+    parser.add_argument("--zone", action="append", help="Zone ID. It can be repeated.")
+    parser.add_argument(
+        "--source", action="append", choices=const.SOURCES, help="It can be repeated."
+    )
+    parser.add_argument("--start", help="First BPA date. Format: YYYY-MM-DD")
+    parser.add_argument("--end", help="Last BPA date. Format: YYYY-MM-DD")
+    parser.add_argument("--output", help="Output file. Default stdout.")
+    args = parser.parse_args()
+
+    for date in (args.start, args.end):
+        if date:
+            datetime.strptime(date, "%Y-%m-%d")
+
+    start_time = datetime.now()
+    query = export_query(
+        zones=args.zone, sources=args.source, start=args.start, end=args.end
+    )
+    log(f"Exporting BPA history as {args.export_format.upper()}...")
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as output:
+            count = export(
+                query=query,
+                output=output,
+                export_format=args.export_format,
+                copy=args.copy,
+            )
+    else:
+        count = export(
+            query=query,
+            output=sys.stdout,
+            export_format=args.export_format,
+            copy=args.copy,
+        )
+
+    if count is not None:
+        log(f"{count} records exported.")
+    log(
+        "Total time elapsed: {:.2f} seconds.".format(
+            (datetime.now() - start_time).total_seconds()
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,16 +16,21 @@
 #   November 2021
 #
 ############################################################
-import sys
+import re
 import time
 from datetime import datetime
-from typing import Iterable, List
-
-import requests
-from PyPDF2 import PdfReader
+from typing import Dict, Iterable, List, Optional
 
 import atesmaps_utilities as ates_utils
 import bpa_urls
+import constants as const
+import date_window
+import geojson_snapshot
+import pdf_extraction as pdf
+import profiling
+import remote_pdf
+import run_ledger
+import settings
 
 # ----- CONFIGURATION ----- #
 
@@ -40,6 +45,25 @@ ICGC_ZONES = [
     "Ter - Freser",
 ]
 
+# ----- PDF pages ----- #
+# First page is the cover. Next pages have one zone each one.
+# Only these pages are downloaded (HTTP range requests). If some
+# zones are not found, the full PDF is downloaded and all pages
+# are searched.
+ICGC_FIRST_PAGE = 1
+ICGC_PAGES = range(ICGC_FIRST_PAGE, ICGC_FIRST_PAGE + len(ICGC_ZONES))
+ICGC_CLIP = None  # Full page
+
+# ----- BPA date ----- #
+# The BPA date is read from the cover page (downloaded with the zone pages).
+ICGC_DATE_PAGE = 0
+RE_DATE = re.compile(
+    r"(\d{1,2})\s+d(?:e\s+|')(%s)\s+de\s+(\d{4})"
+    % "|".join(const.CATALAN_MONTHS_NUMERIC),
+    re.IGNORECASE,
+)
+RE_NUMERIC_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+
 # ----- Avalanche Levels ----- #
 AVALANCHE_LEVELS = {
     "Feble (1)": 1,
@@ -51,32 +75,111 @@ AVALANCHE_LEVELS = {
 
 
 def get_report(
-    output_file: str, date: str = datetime.today().strftime("%Y-%m-%d")
-) -> None:
+    output_file: str,
+    date: str,
+    headers: Optional[Dict[str, str]] = None,
+    all_pages: bool = False,
+) -> bool:
     """
-    Do an API call and return BPA data in PDF.
+    Do an API call and save BPA data in PDF. Return False if the
+    BPA report is not available.
 
     :param output_file: String with the full path for the new PDF file.
-    :param date: Select specific date for BPA. Default today.
-                 Format: YYYY-MM-DD
+    :param date: Select specific date for BPA. Format: YYYY-MM-DD
+    :param headers: Headers of the bulletin probe (size and range requests support).
+    :param all_pages: Download the full PDF instead of the cover and ICGC_PAGES.
     """
 
     try:
-        print("Downloading ICGC BPA report...")
-        response = requests.get(url=bpa_urls.BPA_ICGC_URL.format(date=date))
-        if response.status_code != 200:
+        print(f"Downloading ICGC BPA report for date '{date}'...")
+        status, content = remote_pdf.fetch_pdf(
+            url=bpa_urls.BPA_ICGC_URL.format(date=date),
+            pages=None if all_pages else [ICGC_DATE_PAGE, *ICGC_PAGES],
+            headers=headers,
+        )
+        if status != 200:
             print(
                 f"Avalanche report for zone ICGC using date {date} is not available yet."
             )
-            sys.exit(1)
+            return False
         # Download report as PDF
         with open(output_file, "wb") as f:
-            f.write(response.content)
-        return
+            f.write(content)
+        return True
     except Exception as exc:
         raise Exception("Couldn't get ICGC BPA.") from exc
 
 
+def get_reports(date: str) -> Dict[str, str]:
+    """
+    Download new BPA reports (not stored yet) published for the dates
+    around selected date (yesterday, today and tomorrow) and return
+    dictionary with the date of the report URL and PDF file path.
+    Available dates are probed concurrently.
+
+    :param date: Select specific date for BPA. Format: YYYY-MM-DD
+    """
+
+    def fetch(bpa_date: str, headers: Dict[str, str]) -> Optional[str]:
+        pdf_bpa = f"/tmp/icgc_bpa_{bpa_date}.pdf"
+        if get_report(output_file=pdf_bpa, date=bpa_date, headers=headers):
+            return pdf_bpa
+        return None
+
+    pdf_files = date_window.fetch_new(
+        url_template=bpa_urls.BPA_ICGC_URL,
+        date=date,
+        zone_names=const.SOURCE_ZONES["icgc"],
+        fetch=fetch,
+        force=settings.FORCE_REFRESH,
+    )
+
+    reports = {}
+    for bpa_date in sorted(pdf_files):
+        if pdf_files[bpa_date] is not None:
+            with open(pdf_files[bpa_date], "rb") as f:
+                run_ledger.record_content(content=f.read())
+            reports[bpa_date] = pdf_files[bpa_date]
+
+    return reports
+
+
+def get_bpa_publication_date(bpa_file: str) -> Optional[str]:
+    """
+    Return BPA date from the cover page of the report. If there are
+    several dates (ex: issue date of the bulletin), the latest one is
+    the BPA date. Return None if there is no date in the cover page.
+
+    :param bpa_file: PDF file path with BPA report.
+    """
+
+    try:
+        print("Obtaining BPA report date...")
+        with pdf.open_pdf(pdf_file=bpa_file) as doc:
+            if doc.page_count <= ICGC_DATE_PAGE:
+                return
+            lines = pdf.extract_lines(doc=doc, pages=[ICGC_DATE_PAGE])
+        text = " ".join(lines.get(ICGC_DATE_PAGE, []))
+
+        dates = [
+            (year, const.CATALAN_MONTHS_NUMERIC[month.lower()], day)
+            for day, month, year in RE_DATE.findall(text)
+        ]
+        dates += [
+            (year, month, day) for day, month, year in RE_NUMERIC_DATE.findall(text)
+        ]
+        bpa_dates = []
+        for year, month, day in dates:
+            try:
+                bpa_dates.append(datetime(int(year), int(month), int(day)))
+            except ValueError:
+                continue
+
+        return max(bpa_dates).strftime("%Y-%m-%d") if bpa_dates else None
+    except Exception as exc:
+        raise Exception("Couldn't get avalanche report date from ICGC BPA.") from exc
+
+
 def remove_duplicates(dup_list: Iterable) -> List:
     """
     Remove list duplicates.
@@ -102,21 +205,27 @@ def levels_to_numeric(danger_levels: Iterable) -> List:
     return num_levels
 
 
-def danger_levels_from_bpa(bpa_file: str) -> list:
+def danger_levels_from_bpa(bpa_file: str, all_pages: bool = False) -> list:
     """
     Return avalanche danger level from BPA report for each zone.
 
     :param bpa_file: PDF file path with BPA report.
+    :param all_pages: Search zones in all pages instead of ICGC_PAGES.
     """
 
     try:
         levels_from_bpa = []
 
-        # Parse BPA in PDF format.
-        with open(bpa_file, "rb") as f:
-            reader = PdfReader(f)
-            for page in range(1, len(reader.pages)):
-                contents = reader.pages[page].extract_text().split("\n")
+        # Parse BPA in PDF format. Only pages with zone names are extracted.
+        with pdf.open_pdf(pdf_file=bpa_file) as doc:
+            if all_pages:
+                candidate_pages = range(ICGC_FIRST_PAGE, doc.page_count)
+            else:
+                candidate_pages = [page for page in ICGC_PAGES if page < doc.page_count]
+            pages_text = pdf.extract_lines(
+                doc=doc, pages=candidate_pages, clip=ICGC_CLIP, needles=ICGC_ZONES
+            )
+            for page, contents in pages_text.items():
                 danger_levels = []
                 zone = []
                 for elem in contents:
@@ -169,6 +278,31 @@ def danger_levels_from_bpa(bpa_file: str) -> list:
         raise Exception("Couldn't get avalanche danger level from ICGC BPA.") from exc
 
 
+def get_zone_levels(bpa_file: str, date: str) -> list:
+    """
+    Return avalanche danger level for each zone from ICGC_PAGES of the
+    BPA report. If some zones are not found (pages layout changed), the
+    full report is downloaded again and all pages are searched.
+
+    :param bpa_file: PDF file path with BPA report.
+    :param date: Date of the report URL. Format: YYYY-MM-DD
+    """
+
+    levels = danger_levels_from_bpa(bpa_file=bpa_file)
+    zones_found = len({level["zone_id"] for level in levels})
+    if zones_found >= len(ICGC_ZONES):
+        return levels
+
+    print(
+        f"WARNING: Only {zones_found} of {len(ICGC_ZONES)} zones found in pages "
+        f"{ICGC_PAGES.start}-{ICGC_PAGES.stop - 1}. Retrying with all pages..."
+    )
+    if not get_report(output_file=bpa_file, date=date, all_pages=True):
+        return levels
+
+    return danger_levels_from_bpa(bpa_file=bpa_file, all_pages=True)
+
+
 def main() -> None:
     """Extract BPA data from ICGC web portal."""
 
@@ -176,26 +310,46 @@ def main() -> None:
     start_time = time.time()
     print("** ATESMaps Avalanche Report Extractor **")
 
-    # Today date in format YYYY-MM-DD
-    today = datetime.today().strftime("%Y-%m-%d")
+    # Today date (or CUSTOM_DATE) in format YYYY-MM-DD
+    today = settings.CUSTOM_DATE or datetime.today().strftime("%Y-%m-%d")
 
     print("Updating avalanche danger level...")
     print("Zone: ICGC - Catalunya Pyrenees")
     print(f"Date: {today}")
 
-    # Get danger level
-    pdf_bpa = f"/tmp/icgc_bpa_{today}.pdf"
-    get_report(output_file=pdf_bpa)
-    danger_lvls = danger_levels_from_bpa(bpa_file=pdf_bpa)
+    # Get new BPA reports
+    with profiling.stage(source="icgc", name="fetch"):
+        reports = get_reports(date=today)
+
+    levels = []
+    with profiling.stage(source="icgc", name="parse"):
+        for url_date, pdf_bpa in reports.items():
+            # Get BPA date from report (date of the report URL if it's not found)
+            bpa_date = get_bpa_publication_date(bpa_file=pdf_bpa)
+            if bpa_date is None:
+                print(
+                    f"WARNING: BPA date not found in report. Using URL date '{url_date}'."
+                )
+                bpa_date = url_date
+            elif bpa_date != url_date:
+                print(
+                    f"WARNING: BPA date '{bpa_date}' differs from URL date '{url_date}'."
+                )
+            print(f"BPA report date: {bpa_date}")
+            levels += [
+                {**zone, "date": bpa_date}
+                for zone in get_zone_levels(bpa_file=pdf_bpa, date=url_date)
+            ]
 
     # Insert data to DB
-    for zone in danger_lvls:
-        ates_utils.save_data(
-            zone_name=zone["zone_name"],
-            zone_id=zone["zone_id"],
-            date=today,
-            level=zone["level"],
-        )
+    with profiling.stage(source="icgc", name="save"):
+        rows_written = ates_utils.save_levels(levels=levels)
+
+    run_ledger.record_levels(zones_parsed=len(levels), rows_written=rows_written)
+
+    # Update GeoJSON snapshot with new danger levels
+    if rows_written:
+        geojson_snapshot.write_snapshot()
 
     # End
     print("Total time elapsed: {:.2f} seconds.".format(time.time() - start_time))
@@ -203,4 +357,5 @@ def main() -> None:
 
 
 # Trigger
-main()
+with run_ledger.track(source="icgc"):
+    main()
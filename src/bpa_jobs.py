@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Jobs Queue
+#
+#   Python script for distribute BPA extractions between
+#   several workers using a jobs table in database. Jobs
+#   are pairs (source, date) claimed with
+#   SELECT ... FOR UPDATE SKIP LOCKED, so any number of
+#   workers can run at the same time in different hosts.
+#
+#   Usage:
+#       python3 bpa_jobs.py enqueue-live [--force]
+#       python3 bpa_jobs.py enqueue-backfill --source icgc \
+#           --start 2023-12-01 --end 2024-05-31
+#       python3 bpa_jobs.py work [--once]
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+import bpa_planner
+import constants as const
+import db_connector as db
+import settings
+
+# ----- CONFIGURATION ----- #
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Job status
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_DEAD = "dead"
+
+# Extractor timeout: lease minus a margin, so the job is finished or failed
+# before other workers can claim it again (lease starts at claim time)
+JOB_TIMEOUT = max(
+    settings.JOB_LEASE_SECONDS - max(60, settings.JOB_LEASE_SECONDS // 10),
+    settings.JOB_LEASE_SECONDS // 2,
+)
+
+# Job kinds
+KIND_LIVE = "live"
+KIND_BACKFILL = "backfill"
+
+# Stop flag (SIGTERM / SIGINT)
+stop_requested = False
+
+
+def enqueue(source: str, dates: Iterable[str], kind: str) -> int:
+    """
+    Add new jobs to the queue and return the number of jobs added.
+    Jobs already pending or running for same source and date are skipped.
+
+    :param source: BPA source name. Ex: icgc
+    :param dates: BPA dates in format YYYY-MM-DD.
+    :param kind: Job kind (live or backfill).
+    """
+
+    if source not in const.SOURCES:
+        raise Exception(f"Unknown BPA source '{source}'.")
+
+    values = ", ".join(
+        f"('{source}', '{date}', '{kind}', {settings.JOB_MAX_ATTEMPTS})"
+        for date in dates
+    )
+    if not values:
+        return 0
+
+    q = f"""INSERT INTO {const.TABLE_BPA_JOBS} (source, bpa_date, kind, max_attempts)
+            VALUES {values}
+            ON CONFLICT (source, bpa_date) WHERE status IN ('{STATUS_PENDING}', '{STATUS_RUNNING}')
+            DO NOTHING
+            RETURNING id"""
+
+    return len(db.update_data_returning(query=q))
+
+
+def enqueue_live(force: bool = False) -> None:
+    """
+    Add one live job for today for each source that could
+    still produce new BPA data.
+
+    :param force: Add jobs for all sources.
+    """
+
+    today = datetime.today().date()
+    for source in bpa_planner.plan_sources(day=today, force=force):
+        added = enqueue(
+            source=source, dates=[today.strftime("%Y-%m-%d")], kind=KIND_LIVE
+        )
+        print(f"Added {added} live job(s) for source '{source}'.")
+
+
+def enqueue_backfill(source: str, start: str, end: str) -> None:
+    """
+    Add one backfill job for each date between start and end (both included).
+
+    :param source: BPA source name. Ex: icgc
+    :param start: First BPA date in format YYYY-MM-DD.
+    :param end: Last BPA date in format YYYY-MM-DD.
+    """
+
+    if source not in const.SOURCES_WITH_HISTORY:
+        raise Exception(f"Source '{source}' doesn't allow extract past BPA reports.")
+
+    start_date = datetime.strptime(start, "%Y-%m-%d")
+    end_date = datetime.strptime(end, "%Y-%m-%d")
+    dates = []
+    while start_date <= end_date:
+        dates.append(start_date.strftime("%Y-%m-%d"))
+        start_date += timedelta(days=1)
+
+    added = enqueue(source=source, dates=dates, kind=KIND_BACKFILL)
+    print(f"Added {added} backfill job(s) for source '{source}'.")
+
+
+def claim_job() -> Optional[Dict]:
+    """
+    Claim next available job and return it. Jobs with an expired
+    lease (worker died) are claimed again. Return None if there
+    are no jobs available.
+    """
+
+    q = f"""UPDATE {const.TABLE_BPA_JOBS}
+            SET
+                status = '{STATUS_RUNNING}',
+                attempts = attempts + 1,
+                lease_until = now() + interval '{settings.JOB_LEASE_SECONDS} seconds',
+                worker = '{WORKER_ID}',
+                updated_at = now()
+            WHERE id = (
+                SELECT id
+                FROM {const.TABLE_BPA_JOBS}
+                WHERE
+                    (status = '{STATUS_PENDING}' AND run_after <= now())
+                    OR (status = '{STATUS_RUNNING}' AND lease_until < now())
+                ORDER BY run_after, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, source, bpa_date, kind, attempts, max_attempts"""
+
+    response = db.update_data_returning(query=q)
+    if not response:
+        return
+
+    job_id, source, bpa_date, kind, attempts, max_attempts = response[0]
+    return {
+        "id": job_id,
+        "source": source,
+        "bpa_date": bpa_date.strftime("%Y-%m-%d"),
+        "kind": kind,
+        "attempts": attempts,
+        "max_attempts": max_attempts,
+    }
+
+
+def complete_job(job: Dict) -> None:
+    """
+    Mark job as done.
+
+    :param job: Job claimed by this worker.
+    """
+
+    q = f"""UPDATE {const.TABLE_BPA_JOBS}
+            SET status = '{STATUS_DONE}', lease_until = NULL, last_error = NULL, updated_at = now()
+            WHERE id = {job["id"]} AND worker = '{WORKER_ID}'"""
+    db.update_data(query=q)
+
+
+def fail_job(job: Dict, error: str) -> None:
+    """
+    Schedule a retry of the job with exponential backoff, or move it
+    to dead-letter state if max attempts have been reached.
+
+    :param job: Job claimed by this worker.
+    :param error: Error message.
+    """
+
+    error = error.replace("'", "''")
+    if job["attempts"] >= job["max_attempts"]:
+        print(f"Job {job['id']} reached max attempts. Moving to dead-letter state.")
+        status, delay = STATUS_DEAD, 0
+    else:
+        status = STATUS_PENDING
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+
+    q = f"""UPDATE {const.TABLE_BPA_JOBS}
+            SET
+                status = '{status}',
+                lease_until = NULL,
+                last_error = '{error}',
+                run_after = now() + interval '{delay} seconds',
+                updated_at = now()
+            WHERE id = {job["id"]} AND worker = '{WORKER_ID}'"""
+    db.update_data(query=q)
+
+
+def run_job(job: Dict) -> None:
+    """
+    Run the extractor of the job source in a new process.
+
+    :param job: Job claimed by this worker.
+    """
+
+    print(
+        f"Running job {job['id']}: source '{job['source']}', date '{job['bpa_date']}' "
+        f"({job['kind']}, attempt {job['attempts']}/{job['max_attempts']})..."
+    )
+    if job["attempts"] > job["max_attempts"]:
+        fail_job(job=job, error="Lease expired after max attempts.")
+        return
+
+    # Live extractors can only read the current bulletin (retries after midnight are stale)
+    today = datetime.today().strftime("%Y-%m-%d")
+    if job["kind"] == KIND_LIVE and job["bpa_date"] != today:
+        print(
+            f"Live job {job['id']} of '{job['bpa_date']}' is stale. Done without running."
+        )
+        complete_job(job=job)
+        return
+
+    # Backfill jobs extract the job date and only save BPA history
+    env = dict(os.environ)
+    env.pop("CUSTOM_DATE", None)
+    env["BPA_BACKFILL"] = "false"
+    if job["kind"] == KIND_BACKFILL:
+        env["CUSTOM_DATE"] = job["bpa_date"]
+        env["BPA_BACKFILL"] = "true"
+
+    extractor = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), f"bpa_{job['source']}.py"
+    )
+    # New process group, so browsers started by the extractor are killed on timeout
+    process = subprocess.Popen(
+        [sys.executable, "-u", extractor], env=env, start_new_session=True
+    )
+    try:
+        returncode = process.wait(timeout=JOB_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        fail_job(job=job, error=f"Timeout after {JOB_TIMEOUT} seconds.")
+        return
+
+    if returncode != 0:
+        fail_job(job=job, error=f"Extractor exited with code {returncode}.")
+        return
+
+    complete_job(job=job)
+    print(f"Job {job['id']} done.")
+
+
+def request_stop(signum, frame) -> None:
+    """
+    Stop worker after the current job.
+    """
+
+    global stop_requested
+    print("Stop requested. Worker will stop after the current job.")
+    stop_requested = True
+
+
+def work(once: bool = False) -> None:
+    """
+    Claim and run jobs until stopped.
+
+    :param once: Stop when there are no jobs available.
+    """
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print(f"Starting BPA worker '{WORKER_ID}'...")
+    while not stop_requested:
+        job = claim_job()
+        if job:
+            run_job(job=job)
+            continue
+        if once:
+            print("No jobs available.")
+            break
+        time.sleep(settings.JOB_POLL_INTERVAL)
+
+    print("Bye.")
+
+
+def main() -> None:
+    """Manage BPA extraction jobs."""
+
+    parser = argparse.ArgumentParser(description="ATESMaps BPA jobs queue")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    live = subparsers.add_parser("enqueue-live", help="Add jobs for today.")
+    live.add_argument("--force", action="store_true", default=settings.FORCE_REFRESH)
+
+    backfill = subparsers.add_parser(
+        "enqueue-backfill", help="Add jobs for past dates."
+    )
+    backfill.add_argument("--source", required=True, choices=const.SOURCES_WITH_HISTORY)
+    backfill.add_argument("--start", required=True, help="Format: YYYY-MM-DD")
+    backfill.add_argument("--end", required=True, help="Format: YYYY-MM-DD")
+
+    worker = subparsers.add_parser("work", help="Run jobs from the queue.")
+    worker.add_argument("--once", action="store_true", help="Stop when queue is empty.")
+
+    args = parser.parse_args()
+    if args.command == "enqueue-live":
+        enqueue_live(force=args.force)
+    elif args.command == "enqueue-backfill":
+        enqueue_backfill(source=args.source, start=args.start, end=args.end)
+    else:
+        work(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Changes Listener
+#
+#   Helper for downstream services that want to react to
+#   danger level changes. The extractors publish each change
+#   in the Postgres channel "bpa_changes" (NOTIFY) with a
+#   JSON payload:
+#       {"zone_id": "...", "old_level": 2, "new_level": 3,
+#        "bpa_date": "YYYY-MM-DD"}
+#
+#   Usage: python3 bpa_listener.py (prints changes)
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import json
+import select
+from typing import Callable, Dict, Optional
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+import constants as const
+import db_connector as db
+
+# ----- CONFIGURATION ----- #
+POLL_TIMEOUT = 60  # Seconds
+
+
+def listen(
+    callback: Callable[[Dict], None],
+    channel: str = const.BPA_CHANGES_CHANNEL,
+    on_listen: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    Listen danger level changes and call callback function with
+    the payload of each change. This function blocks forever.
+
+    :param callback: Function called with each change as dictionary.
+    :param channel: Postgres channel name.
+    :param on_listen: Function called when the channel is listened (before the first change).
+    """
+
+    conn = db.db_conn()
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {channel}")
+        print(f"Listening danger level changes in channel '{channel}'...")
+        if on_listen:
+            on_listen()
+
+        while True:
+            if select.select([conn], [], [], POLL_TIMEOUT) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    callback(json.loads(notify.payload))
+                except Exception as exc:
+                    print(
+                        f"WARNING: Couldn't process change '{notify.payload}'. ERROR: {exc}"
+                    )
+    finally:
+        conn.close()
+
+
+def print_change(change: Dict) -> None:
+    """
+    Print danger level change.
+
+    :param change: Danger level change payload.
+    """
+
+    print(
+        f"Zone '{change['zone_id']}' changed from '{change['old_level']}' "
+        f"to '{change['new_level']}' for date '{change['bpa_date']}'."
+    )
+
+
+if __name__ == "__main__":
+    listen(callback=print_change)
@@ -0,0 +1,438 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Danger Level Matrix
+#
+#   Historical analysis of danger levels. BPA history is
+#   loaded once into a dense matrix of zones x days (one
+#   byte for each zone-day with the effective (max) level,
+#   0 = no data) stored as array('b'), or as a NumPy int8
+#   view if NumPy is installed. Days start on the first day
+#   of the first season (September, see bpa_rollups). The
+#   matrix is saved in a small cache file.
+#
+#   Usage: python3 bpa_matrix.py days-at-least LEVEL [--season 2023-2024]
+#          python3 bpa_matrix.py streak LEVEL [--season 2023-2024]
+#          python3 bpa_matrix.py compare ZONE_ID ZONE_ID [--season 2023-2024]
+#          (use --refresh to ignore the cache)
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import argparse
+import json
+import os
+import time
+from array import array
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import bpa_rollups
+import constants as const
+import db_connector as db
+import geojson_snapshot
+import settings
+import storage
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ----- CONFIGURATION ----- #
+MAX_LEVEL = 5
+NO_DATA = 0
+
+
+def season_range(season: str) -> Tuple[date, date]:
+    """
+    Return first and last date of a season.
+
+    :param season: Season label. Ex: 2023-2024
+    """
+
+    start_year = int(season.split("-")[0])
+    _, start, end = bpa_rollups.get_season(
+        date=f"{start_year}-{bpa_rollups.SEASON_START_MONTH:02d}-01"
+    )
+    return date.fromisoformat(start), date.fromisoformat(end)
+
+
+def load_levels() -> Iterator[Tuple[str, str, date, int]]:
+    """
+    Yield (zone_id, zone_name, bpa_date, danger_level) records. Daily
+    levels rollup table is used if it's enabled, otherwise BPA history
+    is streamed (several records for the same zone-day are possible).
+    """
+
+    if settings.STORAGE_BACKEND != "postgres":
+        for zone_id, zone_name, bpa_date, level, _ in storage.get_history():
+            yield zone_id, zone_name, bpa_date, level
+        return
+
+    table = (
+        const.TABLE_BPA_DAILY_LEVELS
+        if settings.ROLLUPS_ENABLED
+        else const.TABLE_BPA_HISTORY
+    )
+    q = f"""SELECT
+                zone_id,
+                zone_name,
+                bpa_date,
+                danger_level
+            FROM
+                {table}"""
+
+    yield from db.stream_data(query=q)
+
+
+class DangerMatrix:
+    """
+    Dense matrix of zones x days with the effective danger level.
+    Row of each zone is a contiguous slice of the array.
+    """
+
+    def __init__(
+        self,
+        zones: List[Tuple[str, str]],
+        start: date,
+        days: int,
+        data: Optional[array] = None,
+    ):
+        """
+        :param zones: List of (zone_id, zone_name) in row order.
+        :param start: Date of the first column.
+        :param days: Number of columns (days).
+        :param data: Matrix values in row order. Default empty matrix.
+        """
+
+        self.zone_ids = [zone[0] for zone in zones]
+        self.zone_names = dict(zones)
+        self.zone_index = {zone_id: row for row, zone_id in enumerate(self.zone_ids)}
+        self.start = start
+        self.days = days
+        self.data = data if data is not None else array("b", bytes(len(zones) * days))
+
+    @classmethod
+    def from_records(
+        cls, records: Iterator[Tuple[str, str, date, int]]
+    ) -> "DangerMatrix":
+        """
+        Return matrix with the max danger level of each zone-day.
+
+        :param records: (zone_id, zone_name, bpa_date, danger_level) records.
+        """
+
+        levels, zones = {}, {}
+        for zone_id, zone_name, bpa_date, level in records:
+            zones[zone_id] = zone_name
+            key = (zone_id, bpa_date)
+            if level > levels.get(key, NO_DATA):
+                levels[key] = level
+
+        if not levels:
+            return cls(zones=[], start=date.today(), days=0)
+
+        dates = [key[1] for key in levels]
+        _, start, _ = bpa_rollups.get_season(date=min(dates).strftime("%Y-%m-%d"))
+        _, _, end = bpa_rollups.get_season(date=max(dates).strftime("%Y-%m-%d"))
+        start, end = date.fromisoformat(start), date.fromisoformat(end)
+        matrix = cls(
+            zones=sorted(zones.items()), start=start, days=(end - start).days + 1
+        )
+        for (zone_id, bpa_date), level in levels.items():
+            matrix.data[
+                matrix.zone_index[zone_id] * matrix.days + (bpa_date - start).days
+            ] = min(level, MAX_LEVEL)
+
+        return matrix
+
+    def day_range(
+        self, start: Optional[date] = None, end: Optional[date] = None
+    ) -> Tuple[int, int]:
+        """
+        Return column offsets (first included, last excluded) of a date range.
+
+        :param start: First date. Default first day of the matrix.
+        :param end: Last date (included). Default last day of the matrix.
+        """
+
+        first = max(0, (start - self.start).days) if start else 0
+        last = min(self.days, (end - self.start).days + 1) if end else self.days
+        return first, max(first, last)
+
+    def row(
+        self, zone_id: str, start: Optional[date] = None, end: Optional[date] = None
+    ) -> array:
+        """
+        Return danger levels of a zone for each day of the date range.
+
+        :param zone_id: The zone code that identifies uniquely zone.
+        :param start: First date. Default first day of the matrix.
+        :param end: Last date (included). Default last day of the matrix.
+        """
+
+        first, last = self.day_range(start=start, end=end)
+        offset = self.zone_index[zone_id] * self.days
+        return self.data[offset + first : offset + last]  # noqa: E203
+
+    def as_numpy(self):
+        """
+        Return matrix as NumPy int8 array (zones x days) without copying data.
+        """
+
+        if np is None:
+            raise Exception("NumPy is not installed.")
+        return np.frombuffer(self.data, dtype=np.int8).reshape(
+            len(self.zone_ids), self.days
+        )
+
+    def level(self, zone_id: str, day: date) -> Optional[int]:
+        """
+        Return danger level of a zone-day (None if there is no data).
+
+        :param zone_id: The zone code that identifies uniquely zone.
+        :param day: BPA date.
+        """
+
+        offset = (day - self.start).days
+        if zone_id not in self.zone_index or not 0 <= offset < self.days:
+            return
+        return self.data[self.zone_index[zone_id] * self.days + offset] or None
+
+    def days_at_least(
+        self, level: int, start: Optional[date] = None, end: Optional[date] = None
+    ) -> Dict[str, int]:
+        """
+        Return number of days with danger level >= level for each zone.
+
+        :param level: Danger level. Ex: 4
+        :param start: First date. Default first day of the matrix.
+        :param end: Last date (included). Default last day of the matrix.
+        """
+
+        if np is not None:
+            first, last = self.day_range(start=start, end=end)
+            counts = (self.as_numpy()[:, first:last] >= level).sum(axis=1)
+            return dict(zip(self.zone_ids, (int(count) for count in counts)))
+
+        return {
+            zone_id: sum(
+                self.row(zone_id, start, end).count(lvl)
+                for lvl in range(level, MAX_LEVEL + 1)
+            )
+            for zone_id in self.zone_ids
+        }
+
+    def longest_streak(
+        self,
+        zone_id: str,
+        level: int,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ) -> Tuple[int, Optional[date], Optional[date]]:
+        """
+        Return length, first and last date of the longest run of
+        consecutive days with danger level >= level for a zone.
+
+        :param zone_id: The zone code that identifies uniquely zone.
+        :param level: Danger level. Ex: 3
+        :param start: First date. Default first day of the matrix.
+        :param end: Last date (included). Default last day of the matrix.
+        """
+
+        first, _ = self.day_range(start=start, end=end)
+        # Zone-days as bytes: b"1" if level >= selected level, else b"0"
+        table = bytes(b"1"[0] if value >= level else b"0"[0] for value in range(256))
+        flags = self.row(zone_id, start, end).tobytes().translate(table)
+
+        length, position, best_position = 0, 0, None
+        for run in flags.split(b"0"):
+            if len(run) > length:
+                length, best_position = len(run), position
+            position += len(run) + 1
+
+        if not length:
+            return 0, None, None
+        streak_start = self.start + timedelta(days=first + best_position)
+        return length, streak_start, streak_start + timedelta(days=length - 1)
+
+    def compare(
+        self,
+        zone_a: str,
+        zone_b: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ) -> Dict[str, int]:
+        """
+        Compare danger levels of two zones on days with data for both zones.
+        Return number of days with data for both, with the same level and
+        with a higher level in each zone.
+
+        :param zone_a: The zone code that identifies uniquely first zone.
+        :param zone_b: The zone code that identifies uniquely second zone.
+        :param start: First date. Default first day of the matrix.
+        :param end: Last date (included). Default last day of the matrix.
+        """
+
+        if np is not None:
+            first, last = self.day_range(start=start, end=end)
+            matrix = self.as_numpy()
+            a = matrix[self.zone_index[zone_a], first:last]
+            b = matrix[self.zone_index[zone_b], first:last]
+            both = (a > 0) & (b > 0)
+            return {
+                "days": int(both.sum()),
+                "same": int((both & (a == b)).sum()),
+                f"higher_{zone_a}": int((both & (a > b)).sum()),
+                f"higher_{zone_b}": int((both & (a < b)).sum()),
+            }
+
+        pairs = [
+            (a, b)
+            for a, b in zip(self.row(zone_a, start, end), self.row(zone_b, start, end))
+            if a and b
+        ]
+        return {
+            "days": len(pairs),
+            "same": sum(1 for a, b in pairs if a == b),
+            f"higher_{zone_a}": sum(1 for a, b in pairs if a > b),
+            f"higher_{zone_b}": sum(1 for a, b in pairs if a < b),
+        }
+
+    def save(self, path: str) -> None:
+        """
+        Save matrix in a cache file: one JSON line with zones and dates
+        followed by matrix bytes.
+
+        :param path: Cache file path.
+        """
+
+        header = {
+            "zones": [[zone_id, self.zone_names[zone_id]] for zone_id in self.zone_ids],
+            "start": self.start.isoformat(),
+            "days": self.days,
+        }
+        content = (
+            json.dumps(header, ensure_ascii=False).encode("utf-8")
+            + b"\n"
+            + self.data.tobytes()
+        )
+        geojson_snapshot.write_atomic(path=path, content=content)
+
+    @classmethod
+    def load(cls, path: str) -> "DangerMatrix":
+        """
+        Return matrix saved in a cache file.
+
+        :param path: Cache file path.
+        """
+
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            data = array("b")
+            data.frombytes(f.read())
+
+        zones = [tuple(zone) for zone in header["zones"]]
+        if len(data) != len(zones) * header["days"]:
+            raise Exception(f"Corrupted danger level matrix cache '{path}'.")
+        return cls(
+            zones=zones,
+            start=date.fromisoformat(header["start"]),
+            days=header["days"],
+            data=data,
+        )
+
+
+def get_matrix(refresh: bool = False) -> DangerMatrix:
+    """
+    Return danger level matrix. The cache file is used if it's newer
+    than MATRIX_CACHE_MAX_AGE seconds, otherwise the matrix is loaded
+    from database and saved in the cache.
+
+    :param refresh: Ignore cache file.
+    """
+
+    path = settings.MATRIX_CACHE_PATH
+    max_age = settings.MATRIX_CACHE_MAX_AGE
+    if (
+        not refresh
+        and max_age > 0
+        and os.path.exists(path)
+        and time.time() - os.path.getmtime(path) < max_age
+    ):
+        try:
+            return DangerMatrix.load(path=path)
+        except Exception as exc:
+            print(f"WARNING: Couldn't read danger level matrix cache. ERROR: {exc}")
+
+    try:
+        matrix = DangerMatrix.from_records(records=load_levels())
+    except Exception as exc:
+        raise Exception("Couldn't load danger level matrix from database.") from exc
+
+    if max_age > 0:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        matrix.save(path=path)
+
+    return matrix
+
+
+def main() -> None:
+    """Danger level historical analysis."""
+
+    parser = argparse.ArgumentParser(description="ATESMaps BPA danger level matrix")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cache file.")
+    parser.add_argument("--season", help="Season. Ex: 2023-2024. Default all seasons.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    days_at_least = commands.add_parser(
+        "days-at-least", help="Days with danger level >= LEVEL by zone."
+    )
+    days_at_least.add_argument("level", type=int)
+    streak = commands.add_parser(
+        "streak", help="Longest run of days with danger level >= LEVEL by zone."
+    )
+    streak.add_argument("level", type=int)
+    compare = commands.add_parser("compare", help="Compare danger levels of two zones.")
+    compare.add_argument("zones", nargs=2, metavar="ZONE_ID")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    matrix = get_matrix(refresh=args.refresh)
+    start, end = season_range(season=args.season) if args.season else (None, None)
+    print(
+        f"Danger level matrix: {len(matrix.zone_ids)} zones x {matrix.days} days from {matrix.start}."
+    )
+
+    if args.command == "days-at-least":
+        for zone_id, days in matrix.days_at_least(
+            level=args.level, start=start, end=end
+        ).items():
+            print(f"{zone_id:<12}{matrix.zone_names[zone_id]:<36}{days:>6} days")
+    elif args.command == "streak":
+        for zone_id in matrix.zone_ids:
+            length, first, last = matrix.longest_streak(
+                zone_id=zone_id, level=args.level, start=start, end=end
+            )
+            period = f"({first} - {last})" if length else ""
+            print(
+                f"{zone_id:<12}{matrix.zone_names[zone_id]:<36}{length:>6} days {period}"
+            )
+    else:
+        for zone_id in args.zones:
+            if zone_id not in matrix.zone_index:
+                parser.error(f"Zone '{zone_id}' has no danger levels in BPA history.")
+        for key, days in matrix.compare(
+            zone_a=args.zones[0], zone_b=args.zones[1], start=start, end=end
+        ).items():
+            print(f"{key:<24}{days:>6} days")
+
+    print("Total time elapsed: {:.2f} seconds.".format(time.time() - start_time))
+
+
+if __name__ == "__main__":
+    main()
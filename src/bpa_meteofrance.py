@@ -15,9 +15,11 @@
 #   November 2021
 #
 ###############################################################################
+import json
 import time
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -27,6 +29,9 @@ from selenium.webdriver.support.ui import WebDriverWait
 
 import atesmaps_utilities as ates_utils
 import bpa_urls
+import geojson_snapshot
+import profiling
+import run_ledger
 
 # ----- CONFIGURATION ----- #
 
@@ -44,20 +49,163 @@ METEOFRANCE_ZONE_POS = {
     "Cerdagne-Canigou": [631, 334],
 }
 
+# Max distance in pixels between icon position and zone position
+ZONE_POS_TOLERANCE = 8
+
 # Selenium variables
 WAIT_TIME = 20  # Seconds wait (timeout)
 
+# Third-party hosts (ads, analytics, trackers) blocked in Firefox.
+# Cookies policy (didomi) is not blocked because it's needed to accept it.
+BLOCKED_HOSTS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "amazon-adsystem.com",
+    "smartadserver.com",
+    "criteo.com",
+    "criteo.net",
+    "taboola.com",
+    "outbrain.com",
+    "facebook.net",
+    "facebook.com",
+    "xiti.com",
+    "ati-host.net",
+    "hotjar.com",
+]
+
+# Firefox preferences for reduce page load
+FIREFOX_PREFS = {
+    # Block all images. Danger level is read from the img src attribute.
+    "permissions.default.image": 2,
+    # Don't download web fonts
+    "gfx.downloadable_fonts.enabled": False,
+    "browser.display.use_document_fonts": 0,
+    # Tracking protection and no media autoplay
+    "privacy.trackingprotection.enabled": True,
+    "media.autoplay.default": 5,
+    # No disk cache (new profile on each run)
+    "browser.cache.disk.enable": False,
+}
+
+# Return transform and image sources of every avalanche risk icon
+ICON_MAP_SCRIPT = """
+return Array.from(document.getElementsByClassName("iconMap")).map(function (icon) {
+    return {
+        transform: window.getComputedStyle(icon).getPropertyValue("transform"),
+        images: Array.from(icon.getElementsByTagName("img")).map(function (img) {
+            return img.src;
+        }),
+    };
+});
+"""
+
+# Return the number of avalanche risk icons with position in the map
+ICONS_READY_SCRIPT = """
+return Array.from(document.getElementsByClassName("iconMap")).filter(function (icon) {
+    return window.getComputedStyle(icon).getPropertyValue("transform") !== "none";
+}).length;
+"""
+
+
+def build_zone_index(tolerance: int = ZONE_POS_TOLERANCE) -> Dict[Tuple, List]:
+    """
+    Return grid index with zone positions. Each cell has the size of
+    the tolerance, so only the neighbour cells of a position must be
+    checked to find the nearest zone.
+
+    :param tolerance: Max distance in pixels between icon and zone position.
+    """
+
+    index = {}
+    for zone, (x, y) in METEOFRANCE_ZONE_POS.items():
+        cell = (x // tolerance, y // tolerance)
+        index.setdefault(cell, []).append((zone, x, y))
+
+    return index
+
+
+ZONE_INDEX = build_zone_index()
+
 
-def get_zone_from_2d_matrix(x: int, y: int) -> Optional[str]:
+def get_zone_from_2d_matrix(
+    x: int, y: int, tolerance: int = ZONE_POS_TOLERANCE
+) -> Optional[str]:
     """
-    Return zone name for provided coordinates (X,Y)
+    Return nearest zone name for provided coordinates (X,Y)
+    within the pixel tolerance.
     """
 
-    for zone in METEOFRANCE_ZONE_POS:
-        if METEOFRANCE_ZONE_POS[zone] == [x, y]:
-            return zone
+    cell_x, cell_y = x // tolerance, y // tolerance
+    nearest_zone, nearest_dist = None, tolerance**2
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for zone, zone_x, zone_y in ZONE_INDEX.get((cell_x + dx, cell_y + dy), []):
+                dist = (zone_x - x) ** 2 + (zone_y - y) ** 2
+                if dist <= nearest_dist:
+                    nearest_zone, nearest_dist = zone, dist
 
-    return
+    return nearest_zone
+
+
+def get_blocked_hosts_pac() -> str:
+    """
+    Return proxy auto-config (PAC) URL that sends requests for
+    BLOCKED_HOSTS to an unreachable proxy. Other requests are direct.
+    """
+
+    conditions = " || ".join(f'dnsDomainIs(host, "{host}")' for host in BLOCKED_HOSTS)
+    pac = (
+        "function FindProxyForURL(url, host) { "
+        f'if ({conditions}) {{ return "PROXY 127.0.0.1:9"; }} '
+        'return "DIRECT"; }'
+    )
+
+    return f"data:application/x-ns-proxy-autoconfig,{quote(pac)}"
+
+
+def get_firefox_options() -> Options:
+    """
+    Return Firefox options: headless mode, eager page load strategy
+    (don't wait for images, fonts, etc.) and preferences that block
+    third-party images, web fonts and trackers.
+    """
+
+    firefox_options = Options()
+    firefox_options.add_argument("--headless")
+    firefox_options.page_load_strategy = "eager"
+    for pref, value in FIREFOX_PREFS.items():
+        firefox_options.set_preference(pref, value)
+
+    # Block trackers hosts using proxy auto-config. Requests to the
+    # unreachable proxy must fail instead of going direct.
+    firefox_options.set_preference("network.proxy.type", 2)
+    firefox_options.set_preference(
+        "network.proxy.autoconfig_url", get_blocked_hosts_pac()
+    )
+    firefox_options.set_preference("network.proxy.failover_direct", False)
+
+    return firefox_options
+
+
+def wait_for_danger_icons(driver) -> None:
+    """
+    Wait until there is at least one avalanche risk icon with position
+    in the map (CSS transform). Missing zones are reported later.
+
+    :param driver: Selenium Webdriver.
+    """
+
+    try:
+        WebDriverWait(driver, WAIT_TIME).until(
+            lambda driver: driver.execute_script(ICONS_READY_SCRIPT) >= 1
+        )
+    except Exception as exc:
+        raise Exception(
+            "Avalanche risk icons are not available in Meteofrance map."
+        ) from exc
 
 
 def accept_cookies_policy(driver):
@@ -90,14 +238,16 @@ def get_danger_level_by_zone(driver, date: str):
 
     # Danger levels
     danger_levels = []
+    zone_ids = ates_utils.refresh_zone_ids()
 
-    # Find the avalanche risk icons within the map
-    avalancheIconElements = driver.find_elements(By.CLASS_NAME, "iconMap")
-    for area in avalancheIconElements:
+    # Find the avalanche risk icons within the map (single WebDriver call)
+    icons = driver.execute_script(ICON_MAP_SCRIPT)
+    run_ledger.record_content(content=json.dumps(icons, sort_keys=True).encode("utf-8"))
+    for area in icons:
         danger_level = ""
 
         # Get position in map and avalanche icon value
-        css_pos_matrix = area.value_of_css_property("transform")
+        css_pos_matrix = area["transform"] or ""
         pos_matrix = (
             css_pos_matrix[
                 css_pos_matrix.find("(") + 1 : css_pos_matrix.find(")")  # noqa: E203
@@ -105,10 +255,12 @@ def get_danger_level_by_zone(driver, date: str):
             .replace(" ", "")
             .split(",")[-2:]
         )
-        pos_matrix = [int(i) for i in pos_matrix]
-        icon = area.find_elements(By.XPATH, ".//img")
-        for src in icon:
-            url = src.get_attribute("src").split("/")[-1]
+        if len(pos_matrix) != 2:
+            print(f"Skipping icon without position in map: '{css_pos_matrix}'.")
+            continue
+        pos_matrix = [round(float(i)) for i in pos_matrix]
+        for src in area["images"]:
+            url = src.split("/")[-1]
             danger_level = url.split("_")[0]
 
         zone_name = get_zone_from_2d_matrix(x=pos_matrix[0], y=pos_matrix[1])
@@ -119,7 +271,7 @@ def get_danger_level_by_zone(driver, date: str):
             continue
 
         # Get Zone ID from name
-        zone_id = ates_utils.refresh_zone_ids()[zone_name]
+        zone_id = zone_ids[zone_name]
 
         print(f"Danger level for '{zone_name}' zone: {danger_level}")
         danger_levels.append(
@@ -131,6 +283,12 @@ def get_danger_level_by_zone(driver, date: str):
             }
         )
 
+    # Report zones without avalanche risk icon
+    found = {level["zone_name"] for level in danger_levels}
+    for zone_name in METEOFRANCE_ZONE_POS:
+        if zone_name not in found:
+            print(f"WARNING: Danger level for '{zone_name}' zone not found.")
+
     return danger_levels
 
 
@@ -152,31 +310,49 @@ def main():
     print(f"Date: {today}")
 
     # Open the avalanche report URL using Firefox in headless mode
-    firefox_options = Options()
-    firefox_options.add_argument("--headless")
-    driver = webdriver.Firefox(options=firefox_options)
-    driver.get(bpa_urls.BPA_METEOFRANCE_URL)
+    with profiling.stage(source="meteofrance", name="fetch"):
+        driver = webdriver.Firefox(options=get_firefox_options())
+        # Include geckodriver and Firefox processes in memory reports
+        profiling.watch_process(pid=driver.service.process.pid)
+        driver.get(bpa_urls.BPA_METEOFRANCE_URL)
+
+        # Manage cookies policy pop-up
+        accept_cookies_policy(driver=driver)
 
-    # Manage cookies policy pop-up
-    accept_cookies_policy(driver=driver)
+        # Wait only for danger icons (not for the full page load)
+        wait_for_danger_icons(driver=driver)
 
     # Fetch danger levels from Meteofrance web
-    danger_lvls = get_danger_level_by_zone(driver=driver, date=today)
-    for zone in danger_lvls:
-        ates_utils.save_data(
-            zone_name=zone["zone_name"],
-            zone_id=zone["zone_id"],
-            level=zone["danger_level"],
-            date=zone["bpa_date"],
+    with profiling.stage(source="meteofrance", name="parse"):
+        danger_lvls = get_danger_level_by_zone(driver=driver, date=today)
+
+    with profiling.stage(source="meteofrance", name="save"):
+        rows_written = ates_utils.save_levels(
+            levels=[
+                {
+                    "zone_name": zone["zone_name"],
+                    "zone_id": zone["zone_id"],
+                    "date": zone["bpa_date"],
+                    "level": zone["danger_level"],
+                }
+                for zone in danger_lvls
+            ]
         )
 
+    run_ledger.record_levels(zones_parsed=len(danger_lvls), rows_written=rows_written)
+
     # Close browser
     driver.quit()
 
+    # Update GeoJSON snapshot with new danger levels
+    if rows_written:
+        geojson_snapshot.write_snapshot()
+
     # End
     print("Total time elapsed: {:.2f} seconds.".format(time.time() - start_time))
     print("Bye.")
 
 
 # Trigger
-main()
+with run_ledger.track(source="meteofrance"):
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+###############################################################################
+#
+#   ATESMaps - BPA Extractors - METEOFRANCE HISTORY
+#
+#   Python script that imports past avalanche bulletins (BRA) of the
+#   Pyrenees from the MeteoFrance public data XML archive into BPA
+#   history. The archive can be a directory, a zip or a tar file with
+#   the XML bulletins (one file for each massif and day).
+#
+#   +INFO: https://donneespubliques.meteofrance.fr/?fond=produit&id_produit=265&id_rubrique=50
+#
+#   Usage: python3 bpa_meteofrance_history.py PATH
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+###############################################################################
+import argparse
+import os
+import tarfile
+import time
+import unicodedata
+import xml.etree.ElementTree as ET
+import zipfile
+from datetime import datetime, timedelta
+from typing import IO, Dict, Iterator, Optional, Tuple
+
+import atesmaps_utilities as ates_utils
+import bpa_rollups
+import constants as const
+import db_connector as db
+import settings
+
+# ----- CONFIGURATION ----- #
+
+# METEOFRANCE - Pyrenees massif IDs (BRA) and zone names in database.
+# Andorra (71) is updated using Andorra National Weather Service BPA.
+METEOFRANCE_MASSIFS = {
+    64: "Pays Basque",
+    65: "Aspe-Ossau",
+    66: "Haute-Bigorre",
+    67: "Aure-Louron",
+    68: "Luchonnais",
+    69: "Couserans",
+    70: "Haute-Ariege",
+    72: "Orlu St Barthelemy",
+    73: "Capcir-Puymorens",
+    74: "Cerdagne-Canigou",
+}
+
+# Bulk insert batch size
+BATCH_SIZE = 1000
+
+
+def normalize_massif(name: str) -> str:
+    """
+    Return massif name without accents, spaces and symbols in upper case.
+    Ex: "Orlu St Barthélemy" -> "ORLUSTBARTHELEMY"
+
+    :param name: Massif name.
+    """
+
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return "".join(c for c in name.upper() if c.isalnum())
+
+
+MASSIFS_BY_NAME = {
+    normalize_massif(zone): zone for zone in METEOFRANCE_MASSIFS.values()
+}
+
+
+def get_zone_name(
+    massif_id: Optional[str], massif_name: Optional[str]
+) -> Optional[str]:
+    """
+    Return zone name for BRA massif ID or name. Return None if the
+    massif is not a Pyrenees zone.
+
+    :param massif_id: Massif ID. Ex: 64
+    :param massif_name: Massif name. Ex: PAYS-BASQUE
+    """
+
+    if massif_id and massif_id.isdigit():
+        return METEOFRANCE_MASSIFS.get(int(massif_id))
+    if massif_name:
+        return MASSIFS_BY_NAME.get(normalize_massif(massif_name))
+
+    return
+
+
+def parse_bulletin(xml_file: IO) -> Optional[Dict]:
+    """
+    Return zone name, BPA date, publication date and danger level from
+    a BRA XML bulletin. The XML is parsed as a stream and parsing stops
+    when the danger level is found. Return None if the bulletin is not
+    for a Pyrenees zone or has no danger level.
+
+    :param xml_file: File object with XML bulletin.
+    """
+
+    bulletin = {}
+    for _, elem in ET.iterparse(xml_file, events=("start",)):
+        if elem.tag == "BULLETINS_NEIGE_AVALANCHE":
+            zone_name = get_zone_name(
+                massif_id=elem.get("ID"), massif_name=elem.get("MASSIF")
+            )
+            if not zone_name:
+                return
+            published = datetime.fromisoformat(elem.get("DATEBULLETIN"))
+            if elem.get("DATEECHEANCE"):
+                bpa_date = datetime.fromisoformat(elem.get("DATEECHEANCE")).date()
+            else:
+                # Bulletins are published the day before
+                bpa_date = (published + timedelta(days=1)).date()
+            bulletin = {
+                "zone_name": zone_name,
+                "bpa_date": bpa_date,
+                "published": published,
+            }
+        elif elem.tag == "RISQUE" and bulletin:
+            levels = [elem.get("RISQUEMAXI"), elem.get("RISQUE1"), elem.get("RISQUE2")]
+            levels = [
+                int(level) for level in levels if level and level.lstrip("-").isdigit()
+            ]
+            levels = [level for level in levels if 1 <= level <= 5]
+            if not levels:
+                return
+            bulletin["level"] = max(levels)
+            return bulletin
+
+    return
+
+
+def iter_xml_files(path: str) -> Iterator[Tuple[str, IO]]:
+    """
+    Yield (filename, file object) for each XML file in a directory,
+    zip file or tar file.
+
+    :param path: Directory or archive path.
+    """
+
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for filename in sorted(files):
+                if filename.lower().endswith(".xml"):
+                    with open(os.path.join(root, filename), "rb") as f:
+                        yield filename, f
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith(".xml"):
+                    with archive.open(member) as f:
+                        yield member, f
+    elif tarfile.is_tarfile(path):
+        # Stream mode: members are read in order without random access
+        with tarfile.open(path, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(".xml"):
+                    yield member.name, archive.extractfile(member)
+    else:
+        raise Exception(
+            f"Couldn't read BRA archive '{path}'. Use a directory, zip or tar file."
+        )
+
+
+def get_stored_dates() -> set:
+    """
+    Return (zone_id, bpa_date) pairs already stored for Meteofrance zones.
+    """
+
+    zone_names = "', '".join(METEOFRANCE_MASSIFS.values())
+    q = f"""SELECT DISTINCT
+                zone_id,
+                bpa_date
+            FROM
+                {const.TABLE_BPA_HISTORY}
+            WHERE
+                zone_name IN ('{zone_names}')"""
+
+    return {(rec[0], rec[1]) for rec in db.select_data(query=q)}
+
+
+def import_archive(path: str) -> int:
+    """
+    Import BRA bulletins into BPA history and return the number of
+    records added. Zone-days already stored are skipped. If there are
+    several bulletins for the same zone-day, the last published is used.
+
+    :param path: Directory or archive path with XML bulletins.
+    """
+
+    print(f"Reading BRA bulletins from '{path}'...")
+    zone_ids = ates_utils.refresh_zone_ids()
+    bulletins = {}
+    files = 0
+    for filename, xml_file in iter_xml_files(path=path):
+        files += 1
+        try:
+            bulletin = parse_bulletin(xml_file=xml_file)
+        except Exception as exc:
+            print(f"WARNING: Couldn't parse bulletin '{filename}'. ERROR: {exc}")
+            continue
+        if not bulletin:
+            continue
+        if bulletin["zone_name"] not in zone_ids:
+            print(
+                f"WARNING: Skipping bulletin '{filename}' because zone "
+                f"'{bulletin['zone_name']}' is not declared in database."
+            )
+            continue
+
+        key = (zone_ids[bulletin["zone_name"]], bulletin["bpa_date"])
+        if key not in bulletins or bulletins[key]["published"] < bulletin["published"]:
+            bulletins[key] = bulletin
+
+    print(f"Found {len(bulletins)} zone-days with danger level in {files} XML files.")
+
+    stored = get_stored_dates()
+    records = [
+        (b["zone_name"], zone_id, b["published"], b["level"], bpa_date)
+        for (zone_id, bpa_date), b in sorted(
+            bulletins.items(), key=lambda i: (i[0][1], i[0][0])
+        )
+        if (zone_id, bpa_date) not in stored
+    ]
+    print(f"Inserting {len(records)} new records to bpa history table...")
+    if records:
+        q = (
+            f"INSERT INTO {const.TABLE_BPA_HISTORY} (zone_name, zone_id, created_at, danger_level, bpa_date) "
+            "VALUES %s"
+        )
+        db.insert_many(query=q, records=records, page_size=BATCH_SIZE)
+
+    return len(records)
+
+
+def main() -> None:
+    """Import Meteofrance BRA archive into BPA history."""
+
+    parser = argparse.ArgumentParser(
+        description="ATESMaps Meteofrance BRA archive importer"
+    )
+    parser.add_argument(
+        "path", help="Directory, zip or tar file with BRA XML bulletins."
+    )
+    args = parser.parse_args()
+
+    # Init
+    start_time = time.time()
+    print("** ATESMaps Avalanche Report History Importer **")
+    print("Zone: MeteoFrance - Pyrenees Français")
+
+    added = import_archive(path=args.path)
+
+    # Update rollup tables (statistics) with the new history
+    if added and settings.ROLLUPS_ENABLED:
+        bpa_rollups.rebuild()
+
+    # End
+    print("Total time elapsed: {:.2f} seconds.".format(time.time() - start_time))
+    print("Bye.")
+
+
+if __name__ == "__main__":
+    main()
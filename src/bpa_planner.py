@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Pre-flight Planner
+#
+#   Python script that prints the BPA sources (one per
+#   line) that could still produce new data. Sources out
+#   of bulletin season or with BPA data already stored for
+#   all their zones are skipped.
+#
+#   Usage: python3 bpa_planner.py [--force]
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+import constants as const
+import settings
+import storage
+
+
+def log(message: str) -> None:
+    """
+    Print log message to stderr. Stdout is reserved for the plan.
+
+    :param message: Message to print.
+    """
+
+    print(message, file=sys.stderr)
+
+
+def get_seasons() -> Dict[str, Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """
+    Return bulletin season of each source: constants.SOURCE_SEASONS
+    with the seasons set in BPA_SOURCE_SEASONS.
+    """
+
+    seasons = dict(const.SOURCE_SEASONS)
+    for entry in filter(
+        None, (entry.strip() for entry in settings.SOURCE_SEASONS.split(","))
+    ):
+        try:
+            source, start, end = entry.split(":")
+            if source not in const.SOURCES:
+                raise ValueError(f"unknown source '{source}'")
+            seasons[source] = tuple(
+                tuple(int(part) for part in month_day.split("-"))
+                for month_day in (start, end)
+            )
+            for month, day in seasons[source]:
+                datetime(2000, month, day)  # Valid month and day (leap year)
+        except ValueError as exc:
+            raise Exception(
+                f"Couldn't parse bulletin season '{entry}' of BPA_SOURCE_SEASONS."
+            ) from exc
+
+    return seasons
+
+
+def in_season(source: str, day: date) -> bool:
+    """
+    Return True if the source publishes bulletins on selected day.
+
+    :param source: BPA source name. Ex: icgc
+    :param day: Date to check.
+    """
+
+    start, end = get_seasons()[source]
+    current = (day.month, day.day)
+    if start <= end:
+        return start <= current <= end
+
+    # Season crosses the new year
+    return current >= start or current <= end
+
+
+def get_stored_bpa(since: date) -> Set[Tuple[str, date]]:
+    """
+    Return (zone_name, bpa_date) pairs already stored from the selected date.
+
+    :param since: First BPA date to check.
+    """
+
+    history = storage.get_history(start=since.strftime("%Y-%m-%d"))
+
+    return {(rec[1], rec[2]) for rec in history}
+
+
+def plan_sources(day: date, force: bool = False) -> List[str]:
+    """
+    Return the sources that could still produce new BPA data.
+
+    :param day: Current date.
+    :param force: Return all sources without checking season or database.
+    """
+
+    if force:
+        log("Forced refresh. All sources will be extracted.")
+        return list(const.SOURCES)
+
+    sources = []
+    for source in const.SOURCES:
+        if in_season(source=source, day=day):
+            sources.append(source)
+        else:
+            (start_month, start_day), (end_month, end_day) = get_seasons()[source]
+            log(
+                f"Skipping source '{source}' because it is out of bulletin season "
+                f"({start_month:02d}-{start_day:02d} to {end_month:02d}-{end_day:02d}, "
+                "see BPA_SOURCE_SEASONS)."
+            )
+
+    if not sources:
+        return sources
+
+    stored = get_stored_bpa(since=day)
+    pending = []
+    for source in sources:
+        dates = [day]
+        if source in const.SOURCES_PUBLISH_AHEAD:
+            dates.append(day + timedelta(days=1))
+
+        missing = [
+            (zone, bpa_date)
+            for zone in const.SOURCE_ZONES[source]
+            for bpa_date in dates
+            if (zone, bpa_date) not in stored
+        ]
+        if missing:
+            pending.append(source)
+        else:
+            log(f"Skipping source '{source}' because BPA data is already stored.")
+
+    return pending
+
+
+def main() -> None:
+    """Print the BPA sources that should be extracted."""
+
+    parser = argparse.ArgumentParser(description="ATESMaps BPA pre-flight planner")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=settings.FORCE_REFRESH,
+        help="Run all sources even if BPA data is already stored.",
+    )
+    args = parser.parse_args()
+
+    today = datetime.today().date()
+    log(f"Planning BPA extractors for date '{today}'...")
+    for source in plan_sources(day=today, force=args.force):
+        print(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Rollup Tables
+#
+#   Danger level statistics maintained incrementally on
+#   each write (see storage_postgres.save_levels):
+#       * bpa_daily_levels: Effective (max) level per zone-day.
+#       * bpa_season_stats: Aggregates per zone-season.
+#       * bpa_monthly_stats: Aggregates per zone-month.
+#
+#   Usage: python3 bpa_rollups.py rebuild
+#          (recompute all rollup tables from BPA history)
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import argparse
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+import constants as const
+import db_connector as db
+
+# ----- CONFIGURATION ----- #
+SEASON_START_MONTH = 9  # Seasons from September to August
+HIGH_DANGER_LEVEL = 3  # First and last day at level >= 3
+
+# Season label for a BPA date. Ex: 2024-2025
+SEASON_SQL = (
+    f"CASE WHEN EXTRACT(MONTH FROM bpa_date) >= {SEASON_START_MONTH} "
+    "THEN EXTRACT(YEAR FROM bpa_date)::int || '-' || (EXTRACT(YEAR FROM bpa_date)::int + 1) "
+    "ELSE (EXTRACT(YEAR FROM bpa_date)::int - 1) || '-' || EXTRACT(YEAR FROM bpa_date)::int END"
+)
+
+
+def get_season(date: str) -> Tuple[str, str, str]:
+    """
+    Return season label, first and last date of the season for a BPA date.
+
+    :param date: The BPA report date in format YYYY-MM-DD.
+    """
+
+    bpa_date = datetime.strptime(date, "%Y-%m-%d")
+    start_year = (
+        bpa_date.year if bpa_date.month >= SEASON_START_MONTH else bpa_date.year - 1
+    )
+    start = datetime(start_year, SEASON_START_MONTH, 1)
+    end = datetime(start_year + 1, SEASON_START_MONTH, 1) - timedelta(days=1)
+
+    return (
+        f"{start_year}-{start_year + 1}",
+        start.strftime("%Y-%m-%d"),
+        end.strftime("%Y-%m-%d"),
+    )
+
+
+def daily_level_query(zone_name: str, zone_id: str, date: str, level: int) -> str:
+    """
+    Return SQL statement that updates the effective level of the zone-day.
+
+    :param zone_name: The name of the zone.
+    :param zone_id: The zone code that identifies uniquely zone.
+    :param date: The BPA report date in format YYYY-MM-DD.
+    :param level: Avalanche danger level.
+    """
+
+    return f"""INSERT INTO {const.TABLE_BPA_DAILY_LEVELS} (zone_id, bpa_date, zone_name, danger_level, updated_at)
+               VALUES ('{zone_id}', '{date}', '{zone_name}', {level}, now())
+               ON CONFLICT (zone_id, bpa_date) DO UPDATE SET
+                   danger_level = GREATEST({const.TABLE_BPA_DAILY_LEVELS}.danger_level, EXCLUDED.danger_level),
+                   zone_name = EXCLUDED.zone_name,
+                   updated_at = EXCLUDED.updated_at"""
+
+
+def daily_levels_with_changes(where: str) -> str:
+    """
+    Return SQL subquery with daily levels, season and a flag (changed)
+    when the level is different from the previous day of the season.
+
+    :param where: SQL condition for filter daily levels.
+    """
+
+    return f"""SELECT
+                    zone_id,
+                    zone_name,
+                    bpa_date,
+                    danger_level,
+                    {SEASON_SQL} AS season,
+                    CASE WHEN LAG(danger_level) OVER (
+                        PARTITION BY zone_id, {SEASON_SQL} ORDER BY bpa_date
+                    ) <> danger_level THEN 1 ELSE 0 END AS changed
+                FROM
+                    {const.TABLE_BPA_DAILY_LEVELS}
+                WHERE
+                    {where}"""
+
+
+def season_stats_query(where: str) -> str:
+    """
+    Return SQL statement that recomputes season statistics from daily levels.
+
+    :param where: SQL condition for filter daily levels.
+    """
+
+    days_by_level = ",\n                   ".join(
+        f"COUNT(*) FILTER (WHERE danger_level = {level})" for level in range(1, 6)
+    )
+
+    return f"""INSERT INTO {const.TABLE_BPA_SEASON_STATS} (
+                   zone_id, season, zone_name, days,
+                   days_level_1, days_level_2, days_level_3, days_level_4, days_level_5,
+                   first_day_high, last_day_high, level_changes, updated_at
+               )
+               SELECT
+                   zone_id,
+                   season,
+                   MAX(zone_name),
+                   COUNT(*),
+                   {days_by_level},
+                   MIN(bpa_date) FILTER (WHERE danger_level >= {HIGH_DANGER_LEVEL}),
+                   MAX(bpa_date) FILTER (WHERE danger_level >= {HIGH_DANGER_LEVEL}),
+                   SUM(changed),
+                   now()
+               FROM
+                   ({daily_levels_with_changes(where=where)}) AS daily
+               GROUP BY
+                   zone_id, season
+               ON CONFLICT (zone_id, season) DO UPDATE SET
+                   zone_name = EXCLUDED.zone_name,
+                   days = EXCLUDED.days,
+                   days_level_1 = EXCLUDED.days_level_1,
+                   days_level_2 = EXCLUDED.days_level_2,
+                   days_level_3 = EXCLUDED.days_level_3,
+                   days_level_4 = EXCLUDED.days_level_4,
+                   days_level_5 = EXCLUDED.days_level_5,
+                   first_day_high = EXCLUDED.first_day_high,
+                   last_day_high = EXCLUDED.last_day_high,
+                   level_changes = EXCLUDED.level_changes,
+                   updated_at = EXCLUDED.updated_at"""
+
+
+def monthly_stats_query(where: str) -> str:
+    """
+    Return SQL statement that recomputes monthly statistics from daily levels.
+
+    :param where: SQL condition for filter daily levels.
+    """
+
+    return f"""INSERT INTO {const.TABLE_BPA_MONTHLY_STATS} (
+                   zone_id, month, zone_name, days, max_level, level_changes, updated_at
+               )
+               SELECT
+                   zone_id,
+                   date_trunc('month', bpa_date)::date,
+                   MAX(zone_name),
+                   COUNT(*),
+                   MAX(danger_level),
+                   SUM(changed),
+                   now()
+               FROM
+                   ({daily_levels_with_changes(where=where)}) AS daily
+               GROUP BY
+                   zone_id, date_trunc('month', bpa_date)::date
+               ON CONFLICT (zone_id, month) DO UPDATE SET
+                   zone_name = EXCLUDED.zone_name,
+                   days = EXCLUDED.days,
+                   max_level = EXCLUDED.max_level,
+                   level_changes = EXCLUDED.level_changes,
+                   updated_at = EXCLUDED.updated_at"""
+
+
+def rollup_queries(zone_name: str, zone_id: str, date: str, level: int) -> List[str]:
+    """
+    Return SQL statements that update rollup tables for a new danger level.
+    Only the zone-day and the zone-season of the new level are recomputed.
+
+    :param zone_name: The name of the zone.
+    :param zone_id: The zone code that identifies uniquely zone.
+    :param date: The BPA report date in format YYYY-MM-DD.
+    :param level: Avalanche danger level.
+    """
+
+    _, start, end = get_season(date=date)
+    where = f"zone_id = '{zone_id}' AND bpa_date BETWEEN '{start}' AND '{end}'"
+
+    return [
+        daily_level_query(zone_name=zone_name, zone_id=zone_id, date=date, level=level),
+        season_stats_query(where=where),
+        monthly_stats_query(where=where),
+    ]
+
+
+def rebuild() -> None:
+    """
+    Recompute all rollup tables from BPA history in a single transaction.
+    """
+
+    print("Rebuilding rollup tables from BPA history...")
+    queries = [
+        f"TRUNCATE {const.TABLE_BPA_DAILY_LEVELS}, {const.TABLE_BPA_SEASON_STATS}, {const.TABLE_BPA_MONTHLY_STATS}",
+        f"""INSERT INTO {const.TABLE_BPA_DAILY_LEVELS} (zone_id, bpa_date, zone_name, danger_level, updated_at)
+            SELECT zone_id, bpa_date, MAX(zone_name), MAX(danger_level), now()
+            FROM {const.TABLE_BPA_HISTORY}
+            GROUP BY zone_id, bpa_date""",
+        season_stats_query(where="TRUE"),
+        monthly_stats_query(where="TRUE"),
+    ]
+    db.update_data_transaction(queries=queries)
+    print("Rollup tables rebuilt.")
+
+
+def main() -> None:
+    """Manage rollup tables."""
+
+    parser = argparse.ArgumentParser(description="ATESMaps BPA rollup tables")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    rebuild()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,68 @@
 # Database table names
 TABLE_BPA = "limitszonesbpa"
 TABLE_BPA_HISTORY = "bpa_history"
+TABLE_BPA_JOBS = "bpa_jobs"
+TABLE_BPA_DAILY_LEVELS = "bpa_daily_levels"
+TABLE_BPA_SEASON_STATS = "bpa_season_stats"
+TABLE_BPA_MONTHLY_STATS = "bpa_monthly_stats"
+TABLE_EXTRACTOR_RUNS = "extractor_runs"
+
+# Postgres channel for danger level changes (LISTEN/NOTIFY)
+BPA_CHANGES_CHANNEL = "bpa_changes"
+
+# Geometry column (PostGIS) with zone limits in zones table
+ZONES_GEOMETRY_COLUMN = "geom"
+
+# GeoJSON snapshot file names
+GEOJSON_SNAPSHOT_PREFIX = "bpa_zones"
+GEOJSON_SNAPSHOT_LATEST = "bpa_zones_latest.json"
+
+# BPA sources. The name should match with Python extractor filename (bpa_{source}.py)
+SOURCES = ["andorra", "aran", "icgc", "meteofrance", "aragon_navarra"]
+
+# Zones updated by each source (zone names as saved in database)
+SOURCE_ZONES = {
+    "andorra": ["Andorra nord", "Andorra centre", "Andorra sud"],
+    "aran": ["Aran"],
+    "icgc": [
+        "Franja Nord Pallaresa",
+        "Ribagorçana - Vall Fosca",
+        "Pallaresa",
+        "Perafita - Puigpedrós",
+        "Vessant Nord del Cadí - Moixeró",
+        "Prepirineu",
+        "Ter - Freser",
+    ],
+    "meteofrance": [
+        "Pays Basque",
+        "Aspe-Ossau",
+        "Haute-Bigorre",
+        "Aure-Louron",
+        "Luchonnais",
+        "Couserans",
+        "Haute-Ariege",
+        "Orlu St Barthelemy",
+        "Capcir-Puymorens",
+        "Cerdagne-Canigou",
+    ],
+    "aragon_navarra": ["Navarra", "Jacetania", "Gállego", "Sobrarbe", "Ribagorza"],
+}
+
+# Sources that allow extract BPA for a past date (CUSTOM_DATE)
+SOURCES_WITH_HISTORY = ["aran", "icgc"]
+
+# Sources that publish the BPA for the next day
+SOURCES_PUBLISH_AHEAD = ["aran", "icgc"]
+
+# Default bulletin season calendar for each source: ((start month, day), (end month, day)).
+# Can be changed with environment variable BPA_SOURCE_SEASONS (see settings.py).
+SOURCE_SEASONS = {
+    "andorra": ((11, 15), (5, 31)),
+    "aran": ((11, 15), (5, 31)),
+    "icgc": ((11, 15), (5, 31)),
+    "meteofrance": ((12, 1), (5, 31)),
+    "aragon_navarra": ((12, 1), (5, 31)),
+}
 
 # Spanish months to numeric
 SPANISH_MONTHS_NUMERIC = {
@@ -28,5 +90,21 @@ SPANISH_MONTHS_NUMERIC = {
     "septiembre": "09",
     "octubre": "10",
     "noviembre": "11",
-    "diciembre": "12"
+    "diciembre": "12",
+}
+
+# Catalan months to numeric
+CATALAN_MONTHS_NUMERIC = {
+    "gener": "01",
+    "febrer": "02",
+    "març": "03",
+    "abril": "04",
+    "maig": "05",
+    "juny": "06",
+    "juliol": "07",
+    "agost": "08",
+    "setembre": "09",
+    "octubre": "10",
+    "novembre": "11",
+    "desembre": "12",
 }
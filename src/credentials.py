@@ -19,3 +19,10 @@ DB_HOST = getenv("DB_HOST")
 DB_NAME = getenv("DB_NAME")
 DB_USER = getenv("DB_USER")
 DB_PASSWD = getenv("DB_PASSWD")
+
+# Database read replica credentials (optional). If DB_READ_HOST is not set,
+# all queries are sent to the primary database.
+DB_READ_HOST = getenv("DB_READ_HOST")
+DB_READ_NAME = getenv("DB_READ_NAME", DB_NAME)
+DB_READ_USER = getenv("DB_READ_USER", DB_USER)
+DB_READ_PASSWD = getenv("DB_READ_PASSWD", DB_PASSWD)
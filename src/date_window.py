@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Date Window
+#
+#   Resolve which bulletins of a date window (yesterday,
+#   today and tomorrow by default) are published by sources
+#   with one URL for each date. All candidate URLs are
+#   probed concurrently with HEAD requests (GET if HEAD is
+#   not allowed) and only the bulletins that are not stored
+#   yet are downloaded. Runs for a selected date
+#   (CUSTOM_DATE or backfill) only probe that date.
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+import settings
+import storage
+
+# ----- CONFIGURATION ----- #
+TIMEOUT = 30  # Seconds
+HEAD_NOT_ALLOWED = (405, 501)  # Status codes of servers without HEAD support
+
+
+def candidate_dates(
+    date: str, days_before: Optional[int] = None, days_after: Optional[int] = None
+) -> List[str]:
+    """
+    Return dates of the window from newest to oldest. The window is
+    only the current date if a date is selected (CUSTOM_DATE or backfill).
+
+    :param date: Current date in format YYYY-MM-DD.
+    :param days_before: Days before current date. Default DATE_WINDOW_BEFORE.
+    :param days_after: Days after current date. Default DATE_WINDOW_AFTER.
+    """
+
+    selected_date = bool(settings.CUSTOM_DATE or settings.BACKFILL)
+    if days_before is None:
+        days_before = 0 if selected_date else settings.DATE_WINDOW_BEFORE
+    if days_after is None:
+        days_after = 0 if selected_date else settings.DATE_WINDOW_AFTER
+    current = datetime.strptime(date, "%Y-%m-%d")
+
+    return [
+        (current + timedelta(days=offset)).strftime("%Y-%m-%d")
+        for offset in range(days_after, -days_before - 1, -1)
+    ]
+
+
+def probe(url: str, session: requests.Session) -> Tuple[int, Dict[str, str]]:
+    """
+    Return HTTP status and headers of an URL without downloading the content.
+    HEAD request is used, or GET (body is not read) if HEAD is not allowed.
+
+    :param url: Bulletin URL.
+    :param session: Requests session.
+    """
+
+    response = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if response.status_code in HEAD_NOT_ALLOWED:
+        with session.get(url, stream=True, timeout=TIMEOUT) as response:
+            return response.status_code, dict(response.headers)
+
+    return response.status_code, dict(response.headers)
+
+
+def available_dates(url_template: str, dates: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    Return dictionary with the dates of published bulletins (same order)
+    and the headers of the bulletin response. All dates are probed
+    concurrently.
+
+    :param url_template: Bulletin URL with "{date}" placeholder.
+    :param dates: Dates in format YYYY-MM-DD.
+    """
+
+    with requests.Session() as session, ThreadPoolExecutor(
+        max_workers=len(dates) or 1
+    ) as executor:
+        responses = executor.map(
+            lambda date: probe(url=url_template.format(date=date), session=session),
+            dates,
+        )
+        available = {
+            date: headers
+            for date, (status, headers) in zip(dates, responses)
+            if status == 200
+        }
+
+    for date in dates:
+        print(
+            f"Bulletin for date '{date}': {'available' if date in available else 'not available'}."
+        )
+
+    return available
+
+
+def stored_dates(zone_names: List[str], dates: List[str]) -> List[str]:
+    """
+    Return dates with BPA data already stored for all zones.
+
+    :param zone_names: Zone names as saved in database.
+    :param dates: Dates in format YYYY-MM-DD.
+    """
+
+    if not dates:
+        return []
+
+    zone_ids = storage.get_zone_ids()
+    zone_ids = [
+        zone_ids[zone_name] for zone_name in zone_names if zone_name in zone_ids
+    ]
+    if not zone_ids:
+        return []
+    history = storage.get_history(zone_ids=zone_ids, start=min(dates), end=max(dates))
+    stored = {}
+    for zone_id, _, bpa_date, _, _ in history:
+        stored.setdefault(bpa_date.strftime("%Y-%m-%d"), set()).add(zone_id)
+
+    return [date for date in dates if len(stored.get(date, ())) >= len(zone_ids)]
+
+
+def fetch_new(
+    url_template: str,
+    date: str,
+    zone_names: List[str],
+    fetch: Callable[[str, Dict[str, str]], object],
+    force: bool = False,
+) -> Dict[str, object]:
+    """
+    Probe the bulletins of the date window and download concurrently
+    the bulletins that are not stored yet. Return dictionary with
+    bulletin date (as in the URL) and the value returned by fetch.
+    The dictionary is empty if there are no new bulletins. Exit with
+    code 1 if there is no bulletin available in the window.
+
+    :param url_template: Bulletin URL with "{date}" placeholder.
+    :param date: Current date in format YYYY-MM-DD.
+    :param zone_names: Zones of the source as saved in database.
+    :param fetch: Function that downloads the bulletin of a date (called
+                  with the date and the headers of the probe response).
+    :param force: Download bulletins even if they are already stored.
+    """
+
+    dates = candidate_dates(date=date)
+    print(f"Checking available bulletins for dates: {', '.join(dates)}...")
+    available = available_dates(url_template=url_template, dates=dates)
+    if not available:
+        print("There are no bulletins available yet.")
+        sys.exit(1)
+
+    stored = [] if force else stored_dates(zone_names=zone_names, dates=list(available))
+    new = [date for date in available if date not in stored]
+    for date in stored:
+        print(
+            f"Bulletin for date '{date}' is already in the database. Skipping download."
+        )
+    if not new:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(new)) as executor:
+        return dict(
+            zip(new, executor.map(lambda date: fetch(date, available[date]), new))
+        )
@@ -15,19 +15,43 @@
 #   November 2021
 #
 ############################################################
-from typing import Dict
+from contextlib import contextmanager
+from typing import IO, Dict, Iterator, List
 
 import psycopg2
+from psycopg2.extras import execute_values
 
 import credentials as creds
 
+# Rows fetched from the server in each round trip by streaming queries
+STREAM_ITERSIZE = 2000
 
-def db_conn():
+# Once this process writes to the primary database, all next selects are
+# sent to the primary too, so the extractor always reads its own writes
+# (the read replica may have replication lag).
+primary_pinned = False
+# Number of open primary_reads() contexts
+primary_forced = 0
+
+
+def db_conn(read_only: bool = False):
     """
-    Return opened session with database.
+    Return opened session with database. Read-only sessions are
+    opened with the read replica if it's configured and no data
+    has been written by this process yet.
+
+    :param read_only: The session is used only for selects.
     """
 
     try:
+        if read_only and creds.DB_READ_HOST and not (primary_pinned or primary_forced):
+            return psycopg2.connect(
+                host=creds.DB_READ_HOST,
+                database=creds.DB_READ_NAME,
+                user=creds.DB_READ_USER,
+                password=creds.DB_READ_PASSWD,
+            )
+
         return psycopg2.connect(
             host=creds.DB_HOST,
             database=creds.DB_NAME,
@@ -38,6 +62,29 @@ def db_conn():
         raise Exception("Couldn't connect to database.") from exc
 
 
+def pin_primary() -> None:
+    """
+    Send all next selects of this process to the primary database.
+    """
+
+    global primary_pinned
+    primary_pinned = True
+
+
+@contextmanager
+def primary_reads():
+    """
+    Context manager that sends selects to the primary database.
+    """
+
+    global primary_forced
+    primary_forced += 1
+    try:
+        yield
+    finally:
+        primary_forced -= 1
+
+
 def update_data(query: str) -> bool:
     """
     Do an SQL insert/update to database. Used for save BPA data.
@@ -46,6 +93,7 @@ def update_data(query: str) -> bool:
     """
 
     try:
+        pin_primary()
         db = db_conn()
         with db.cursor() as cursor:
             cursor.execute(query)
@@ -55,16 +103,85 @@ def update_data(query: str) -> bool:
         raise Exception("An error occurred executing SQL select statement.") from exc
 
 
+def update_data_transaction(queries: List[str]) -> None:
+    """
+    Do several SQL statements to database in a single transaction.
+    If any statement fails, no changes are saved.
+
+    :param queries: List of strings with SQL statements.
+    """
+
+    try:
+        pin_primary()
+        db = db_conn()
+        try:
+            with db.cursor() as cursor:
+                for query in queries:
+                    cursor.execute(query)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    except Exception as exc:
+        raise Exception("An error occurred executing SQL transaction.") from exc
+
+
+def insert_many(query: str, records: List[tuple], page_size: int = 1000) -> None:
+    """
+    Do a bulk SQL insert to database in a single transaction.
+
+    :param query: String with SQL insert query with a single "VALUES %s" placeholder.
+    :param records: List of tuples with the values of each record.
+    :param page_size: Number of records sent in each statement.
+    """
+
+    try:
+        pin_primary()
+        db = db_conn()
+        with db.cursor() as cursor:
+            execute_values(cursor, query, records, page_size=page_size)
+        db.commit()
+        db.close()
+    except Exception as exc:
+        raise Exception(
+            "An error occurred executing SQL bulk insert statement."
+        ) from exc
+
+
+def update_data_returning(query: str) -> List:
+    """
+    Do an SQL insert/update to database and return list with
+    the records returned by the statement (RETURNING clause).
+
+    :param query: String with SQL insert/update query with RETURNING clause.
+    """
+
+    try:
+        pin_primary()
+        db = db_conn()
+        with db.cursor() as cursor:
+            cursor.execute(query)
+            response = cursor.fetchall()
+        db.commit()
+        db.close()
+        return response
+    except Exception as exc:
+        raise Exception("An error occurred executing SQL update statement.") from exc
+
+
 def select_data(query: str) -> Dict:
     """
     Do an SQL query to database and return list with
-    records.
+    records. The query is sent to the read replica if it's
+    configured (see db_conn).
 
     :param query: String with SQL select query to do.
     """
 
     try:
-        db = db_conn()
+        db = db_conn(read_only=True)
         with db.cursor() as cursor:
             cursor.execute(query)
             response = cursor.fetchall()
@@ -72,3 +189,52 @@ def select_data(query: str) -> Dict:
             return response
     except Exception as exc:
         raise Exception("An error occurred executing SQL select statement.") from exc
+
+
+def stream_data(query: str, itersize: int = STREAM_ITERSIZE) -> Iterator[tuple]:
+    """
+    Do an SQL query to database and yield records one by one. A named
+    (server-side) cursor is used, so only itersize records are in
+    memory at the same time. The query is sent to the read replica if
+    it's configured (see db_conn).
+
+    :param query: String with SQL select query to do.
+    :param itersize: Number of records fetched from the server in each round trip.
+    """
+
+    try:
+        db = db_conn(read_only=True)
+        try:
+            with db.cursor(name="bpa_stream") as cursor:
+                cursor.itersize = itersize
+                cursor.execute(query)
+                for record in cursor:
+                    yield record
+        finally:
+            db.close()
+    except Exception as exc:
+        raise Exception(
+            "An error occurred executing SQL streaming select statement."
+        ) from exc
+
+
+def copy_to(query: str, file: IO, options: str = "CSV HEADER") -> None:
+    """
+    Write the result of an SQL query to a file using COPY TO STDOUT.
+    Records are formatted by the database server and streamed to the
+    file without being loaded in memory.
+
+    :param query: String with SQL select query to do.
+    :param file: Writable file object.
+    :param options: COPY options. Ex: CSV HEADER
+    """
+
+    try:
+        db = db_conn(read_only=True)
+        try:
+            with db.cursor() as cursor:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH {options}", file)
+        finally:
+            db.close()
+    except Exception as exc:
+        raise Exception("An error occurred executing SQL copy statement.") from exc
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - GeoJSON Snapshot
+#
+#   Generate a static GeoJSON file with all zones and their
+#   current danger level. Clients can download this file
+#   from a CDN instead of querying the database.
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import constants as const
+import db_connector as db
+import settings
+
+
+def get_zones_features() -> List[Dict]:
+    """
+    Return GeoJSON features with the zone limits and current
+    danger level for each zone.
+    """
+
+    geom = f"ST_Transform({const.ZONES_GEOMETRY_COLUMN}, 4326)"
+    if settings.GEOJSON_SIMPLIFY_TOLERANCE > 0:
+        geom = f"ST_SimplifyPreserveTopology({geom}, {settings.GEOJSON_SIMPLIFY_TOLERANCE})"
+
+    q = f"""SELECT
+                codi_zona,
+                zona,
+                bpa,
+                actualitzacio,
+                ST_AsGeoJSON({geom}, {settings.GEOJSON_PRECISION})
+            FROM
+                {const.TABLE_BPA}
+            ORDER BY
+                codi_zona"""
+
+    features = []
+    for zone_id, zone_name, level, updated_at, geometry in db.select_data(query=q):
+        features.append(
+            {
+                "type": "Feature",
+                "id": zone_id,
+                "properties": {
+                    "zone_id": zone_id,
+                    "zone_name": zone_name,
+                    "danger_level": int(level) if level is not None else None,
+                    "updated_at": updated_at.isoformat() if updated_at else None,
+                },
+                "geometry": json.loads(geometry) if geometry else None,
+            }
+        )
+
+    return features
+
+
+def write_atomic(path: str, content: bytes) -> None:
+    """
+    Write file content atomically. The content is written to a
+    temporary file in the same directory and then renamed.
+
+    :param path: Full path of the destination file.
+    :param content: File content as bytes.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_old_snapshots(output_dir: str, current: str) -> None:
+    """
+    Remove old snapshots keeping the last GEOJSON_SNAPSHOT_KEEP files.
+
+    :param output_dir: Directory with the snapshots.
+    :param current: Filename of the current snapshot.
+    """
+
+    snapshots = glob.glob(
+        os.path.join(output_dir, f"{const.GEOJSON_SNAPSHOT_PREFIX}.*.geojson")
+    )
+    snapshots = [s for s in snapshots if os.path.basename(s) != current]
+    snapshots.sort(key=os.path.getmtime, reverse=True)
+    keep = max(settings.GEOJSON_SNAPSHOT_KEEP - 1, 0)
+    for old_snapshot in snapshots[keep:]:
+        os.remove(old_snapshot)
+
+
+def write_snapshot(output_dir: Optional[str] = None) -> Optional[str]:
+    """
+    Generate GeoJSON snapshot with current danger levels and return
+    the full path of the file. The filename contains the content hash.
+    Return None if snapshot directory is not configured or in backfill
+    runs (current danger levels are not updated).
+
+    :param output_dir: Directory for the snapshot. Default GEOJSON_SNAPSHOT_DIR.
+    """
+
+    output_dir = output_dir or settings.GEOJSON_SNAPSHOT_DIR
+    if not output_dir or settings.BACKFILL:
+        return
+
+    try:
+        print("Generating GeoJSON snapshot with current danger levels...")
+        collection = {"type": "FeatureCollection", "features": get_zones_features()}
+        content = json.dumps(
+            collection, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
+        content_hash = hashlib.sha256(content).hexdigest()[:16]
+
+        os.makedirs(output_dir, exist_ok=True)
+        filename = f"{const.GEOJSON_SNAPSHOT_PREFIX}.{content_hash}.geojson"
+        snapshot_path = os.path.join(output_dir, filename)
+        if not os.path.exists(snapshot_path):
+            write_atomic(path=snapshot_path, content=content)
+
+        # Pointer to the last snapshot
+        latest = {
+            "file": filename,
+            "hash": content_hash,
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        write_atomic(
+            path=os.path.join(output_dir, const.GEOJSON_SNAPSHOT_LATEST),
+            content=json.dumps(latest, separators=(",", ":")).encode("utf-8"),
+        )
+        remove_old_snapshots(output_dir=output_dir, current=filename)
+
+        print(f"GeoJSON snapshot saved in '{snapshot_path}'.")
+        return snapshot_path
+    except Exception as exc:
+        raise Exception("Couldn't generate GeoJSON snapshot.") from exc
+
+
+if __name__ == "__main__":
+    write_snapshot()
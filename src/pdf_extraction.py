@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - PDF Extraction
+#
+#   Shared PDF text extraction based on PyMuPDF (fitz).
+#   Returns text blocks with coordinates and allows select
+#   pages and clip rectangles for each source. Pages can be
+#   filtered by the texts they contain (ex: zone names)
+#   using the same blocks, so each page is extracted once.
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import fitz
+
+# Block type for text blocks returned by PyMuPDF
+TEXT_BLOCK = 0
+
+
+def open_pdf(pdf_file: Optional[str] = None, content: Optional[bytes] = None):
+    """
+    Return opened PDF document from file path or bytes.
+
+    :param pdf_file: Full path to PDF file.
+    :param content: PDF content as bytes.
+    """
+
+    try:
+        if content is not None:
+            return fitz.open(stream=content, filetype="pdf")
+        return fitz.open(pdf_file)
+    except Exception as exc:
+        raise Exception(f"Couldn't open PDF file '{pdf_file or 'stream'}'.") from exc
+
+
+def normalize(text: str) -> str:
+    """
+    Return text without whitespaces and in lower case for comparisons.
+
+    :param text: Text to normalize.
+    """
+
+    return "".join(text.split()).lower()
+
+
+def extract_blocks(
+    doc,
+    pages: Optional[Iterable[int]] = None,
+    clip: Optional[Tuple[float, float, float, float]] = None,
+    sort: bool = False,
+    needles: Optional[Iterable[str]] = None,
+) -> List[Dict]:
+    """
+    Return text blocks with coordinates for selected pages.
+    Each block is a dictionary with page, bbox (x0, y0, x1, y1) and text.
+
+    :param doc: Opened PDF document.
+    :param pages: Page numbers (0-based) to extract. Default all pages.
+    :param clip: Rectangle (x0, y0, x1, y1) to extract in each page.
+    :param sort: Sort blocks from top-left to bottom-right.
+    :param needles: Only return pages that contain any of these texts
+                    (comparison ignores whitespaces and case). Ex: zone names.
+    """
+
+    pages = range(doc.page_count) if pages is None else pages
+    needles = None if needles is None else [normalize(needle) for needle in needles]
+
+    blocks = []
+    for page_number in pages:
+        page_blocks = []
+        for block in doc[page_number].get_text("blocks", clip=clip, sort=sort):
+            x0, y0, x1, y1, text, _, block_type = block
+            if block_type != TEXT_BLOCK:
+                continue
+            page_blocks.append(
+                {"page": page_number, "bbox": (x0, y0, x1, y1), "text": text}
+            )
+
+        # Search needles in the text of the blocks already extracted
+        if needles is not None:
+            page_text = normalize("".join(block["text"] for block in page_blocks))
+            if not any(needle in page_text for needle in needles):
+                continue
+        blocks += page_blocks
+
+    return blocks
+
+
+def extract_lines(
+    doc,
+    pages: Optional[Iterable[int]] = None,
+    clip: Optional[Tuple[float, float, float, float]] = None,
+    sort: bool = False,
+    needles: Optional[Iterable[str]] = None,
+) -> Dict[int, List[str]]:
+    """
+    Return text lines for each selected page.
+
+    :param doc: Opened PDF document.
+    :param pages: Page numbers (0-based) to extract. Default all pages.
+    :param clip: Rectangle (x0, y0, x1, y1) to extract in each page.
+    :param sort: Sort blocks from top-left to bottom-right.
+    :param needles: Only return pages that contain any of these texts (see extract_blocks).
+    """
+
+    lines = {}
+    for block in extract_blocks(
+        doc=doc, pages=pages, clip=clip, sort=sort, needles=needles
+    ):
+        page_lines = lines.setdefault(block["page"], [])
+        page_lines += [
+            line.strip() for line in block["text"].split("\n") if line.strip()
+        ]
+
+    return lines
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Profiling
+#
+#   Opt-in profiling of extractor stages (fetch, parse and
+#   save) using cProfile, tracemalloc and peak RSS. Stage
+#   durations are always recorded in the run ledger. Enable it
+#   with environment variable BPA_PROFILE=true or running the
+#   extractor with "--profile" argument. Artifacts are saved
+#   in BPA_PROFILE_DIR.
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import cProfile
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import List
+
+import run_ledger
+import settings
+
+# ----- CONFIGURATION ----- #
+ENABLED = settings.PROFILE or "--profile" in sys.argv
+RUN_ID = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+# Child processes (Ex: geckodriver/Firefox) included in RSS reports
+watched_pids = []
+
+
+def watch_process(pid: int) -> None:
+    """
+    Include process and its children in RSS reports of next stages.
+
+    :param pid: Process ID. Ex: geckodriver process.
+    """
+
+    if ENABLED:
+        watched_pids.append(pid)
+
+
+def get_process_tree(pid: int) -> List[int]:
+    """
+    Return process ID and IDs of all its descendants (Linux only).
+
+    :param pid: Root process ID.
+    """
+
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for child in f.read().split():
+                    pids += get_process_tree(int(child))
+    except OSError:
+        pass
+
+    return pids
+
+
+def get_peak_rss_kb(pid: int) -> int:
+    """
+    Return peak RSS in KB of process and its descendants (sum of VmHWM).
+
+    :param pid: Root process ID.
+    """
+
+    peak = 0
+    for proc in get_process_tree(pid):
+        try:
+            with open(f"/proc/{proc}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+
+    return peak
+
+
+@contextmanager
+def stage(source: str, name: str):
+    """
+    Context manager that records the stage duration in the run ledger
+    and profiles the extractor stage if profiling is enabled.
+
+    :param source: BPA source name. Ex: icgc
+    :param name: Stage name. Ex: fetch, parse, save
+    """
+
+    start = time.perf_counter()
+    try:
+        with profile_stage(source=source, name=name) if ENABLED else nullcontext():
+            yield
+    finally:
+        run_ledger.record_stage(name=name, seconds=time.perf_counter() - start)
+
+
+@contextmanager
+def profile_stage(source: str, name: str):
+    """
+    Profile stage with cProfile and tracemalloc and save artifacts.
+
+    :param source: BPA source name. Ex: icgc
+    :param name: Stage name. Ex: fetch, parse, save
+    """
+
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(settings.PROFILE_DIR, f"{source}_{RUN_ID}_{name}")
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+
+        # cProfile stats
+        profiler.dump_stats(f"{prefix}.pstats")
+
+        # Memory report
+        with open(f"{prefix}_memory.txt", "w") as f:
+            f.write(f"Stage: {source} - {name}\n")
+            f.write(f"Peak traced memory: {traced_peak / 1024:.1f} KB\n")
+            f.write(
+                f"Peak RSS (self): {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss} KB\n"
+            )
+            f.write(
+                f"Peak RSS (finished children): {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss} KB\n"
+            )
+            for pid in watched_pids:
+                f.write(f"Peak RSS (process tree {pid}): {get_peak_rss_kb(pid)} KB\n")
+            f.write(f"\nTop {settings.PROFILE_TOP_ALLOCATIONS} allocations:\n")
+            for stat in snapshot.statistics("lineno")[
+                : settings.PROFILE_TOP_ALLOCATIONS
+            ]:
+                f.write(f"{stat}\n")
+
+        print(f"Profiling artifacts for stage '{name}' saved in '{prefix}*'.")
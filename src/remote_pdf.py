@@ -0,0 +1,379 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Remote PDF
+#
+#   Lazy remote PDF reader that downloads only the parts of
+#   a PDF needed for selected pages using HTTP range
+#   requests: trailer, cross-reference table, page tree and
+#   the objects used by the selected pages. The result is a
+#   PDF with the same size as the original, where bytes that
+#   are not needed are left empty, so it can be opened with
+#   PyMuPDF as usual (only the selected pages).
+#
+#   If the server doesn't support range requests or the PDF
+#   uses cross-reference streams (PDF 1.5+ compressed
+#   objects), the full PDF is downloaded (or the full body
+#   returned for a range request is used).
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import bisect
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import requests
+
+import run_ledger
+
+# ----- CONFIGURATION ----- #
+HEADER_SIZE = 1024  # Bytes with PDF header
+TAIL_SIZE = 16 * 1024  # Bytes with trailer and "startxref"
+XREF_CHUNK = 64 * 1024  # First chunk fetched for cross-reference tables
+MERGE_GAP = 8 * 1024  # Ranges closer than this are fetched in one request
+TIMEOUT = 60  # Seconds
+HEAD_NOT_ALLOWED = (405, 501)  # Status codes of servers without HEAD support
+
+# PDF syntax
+RE_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+RE_REF = re.compile(rb"(\d+)\s+(\d+)\s+R\b")
+RE_PARENT = re.compile(rb"/Parent\s+\d+\s+\d+\s+R")
+RE_KIDS = re.compile(rb"/Kids\s*\[([^\]]*)\]")
+RE_ROOT = re.compile(rb"/Root\s+(\d+)\s+\d+\s+R")
+RE_PAGES = re.compile(rb"/Pages\s+(\d+)\s+\d+\s+R")
+RE_PREV = re.compile(rb"/Prev\s+(\d+)")
+RE_TYPE_PAGE = re.compile(rb"/Type\s*/Page(?!s)")
+
+
+class RangeNotSupported(Exception):
+    """The PDF can't be read using range requests."""
+
+
+class FullContent(RangeNotSupported):
+    """The server returned the full PDF for a range request."""
+
+    def __init__(self, content: bytes):
+        super().__init__("Server returned the full PDF for a range request.")
+        self.content = content
+
+
+class RemotePDF:
+    """
+    PDF file in a remote server read with HTTP range requests.
+    """
+
+    def __init__(self, url: str, size: int, session: requests.Session):
+        self.url = url
+        self.size = size
+        self.session = session
+        self.buffer = bytearray(size)
+        self.filled = bytearray(size)  # 1 for bytes already downloaded
+        self.fetched = 0
+        self.offsets = {}  # Object number -> offset
+        self.boundaries = []  # Sorted offsets (objects and xref sections)
+        self.loaded = set()  # Objects already downloaded
+        self.root = None  # Catalog object number
+
+    def read(self, start: int, end: int) -> bytes:
+        """
+        Download bytes from start to end (both included) and return them.
+
+        :param start: First byte.
+        :param end: Last byte.
+        """
+
+        end = min(end, self.size - 1)
+        response = self.session.get(
+            self.url, headers={"Range": f"bytes={start}-{end}"}, timeout=TIMEOUT
+        )
+        run_ledger.record_response(response=response)
+        if response.status_code == 200:
+            raise FullContent(content=response.content)
+        if response.status_code != 206:
+            raise RangeNotSupported(
+                f"Server returned status {response.status_code} for range request."
+            )
+
+        # Only bytes not downloaded before are counted (ranges can overlap)
+        content = response.content[: end - start + 1]
+        self.buffer[start : start + len(content)] = content  # noqa: E203
+        self.fetched += self.filled[start : start + len(content)].count(0)  # noqa: E203
+        self.filled[start : start + len(content)] = b"\x01" * len(content)  # noqa: E203
+        return content
+
+    def read_xref(self, offset: int) -> Optional[int]:
+        """
+        Parse cross-reference table and trailer at offset and return
+        the offset of the previous table (/Prev) or None.
+
+        :param offset: Offset of the cross-reference table.
+        """
+
+        chunk = XREF_CHUNK
+        while True:
+            data = self.read(offset, offset + chunk - 1)
+            if b"startxref" in data or offset + chunk >= self.size:
+                break
+            chunk *= 2
+
+        if not data.lstrip().startswith(b"xref"):
+            raise RangeNotSupported("Cross-reference streams are not supported.")
+        table, _, trailer = data.partition(b"trailer")
+        trailer = trailer.split(b"startxref")[0]
+        if b"/Encrypt" in trailer or b"/XRefStm" in trailer:
+            raise RangeNotSupported("Encrypted or hybrid PDF files are not supported.")
+
+        tokens = table.split()[1:]
+        index = 0
+        while index + 1 < len(tokens):
+            first, count = int(tokens[index]), int(tokens[index + 1])
+            index += 2
+            for number in range(first, first + count):
+                obj_offset, _, kind = tokens[index : index + 3]  # noqa: E203
+                index += 3
+                if kind == b"n" and number not in self.offsets:
+                    self.offsets[number] = int(obj_offset)
+
+        if self.root is None:
+            root = RE_ROOT.search(trailer)
+            if not root:
+                raise RangeNotSupported("PDF trailer without /Root.")
+            self.root = int(root.group(1))
+
+        self.boundaries.append(offset)
+        prev = RE_PREV.search(trailer)
+        return int(prev.group(1)) if prev else None
+
+    def object_range(self, number: int) -> Tuple[int, int]:
+        """
+        Return byte range (start, end) of an object. The object ends
+        where the next object (or cross-reference table) starts.
+
+        :param number: Object number.
+        """
+
+        start = self.offsets[number]
+        index = bisect.bisect_right(self.boundaries, start)
+        end = (
+            self.boundaries[index] - 1
+            if index < len(self.boundaries)
+            else self.size - 1
+        )
+        return start, end
+
+    def load_objects(self, numbers: Iterable[int]) -> None:
+        """
+        Download objects not loaded yet. Near ranges are merged and
+        downloaded with a single request.
+
+        :param numbers: Object numbers.
+        """
+
+        ranges = sorted(
+            self.object_range(number)
+            for number in set(numbers)
+            if number in self.offsets and number not in self.loaded
+        )
+        merged = []
+        for start, end in ranges:
+            if merged and start - merged[-1][1] <= MERGE_GAP:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        for start, end in merged:
+            self.read(start, end)
+        self.loaded.update(numbers)
+
+    def object_dict(self, number: int) -> bytes:
+        """
+        Return object content without stream data.
+
+        :param number: Object number.
+        """
+
+        start, end = self.object_range(number)
+        return bytes(self.buffer[start : end + 1]).split(b"stream", 1)[0]  # noqa: E203
+
+    def get_refs(self, number: int, skip_parent: bool = False) -> Set[int]:
+        """
+        Return object numbers referenced by an object.
+
+        :param number: Object number.
+        :param skip_parent: Don't follow /Parent references (page tree).
+        """
+
+        content = self.object_dict(number)
+        if skip_parent:
+            content = RE_PARENT.sub(b"", content)
+        return {int(ref[0]) for ref in RE_REF.findall(content)}
+
+    def get_page_objects(self) -> List[int]:
+        """
+        Download page tree and return page object numbers in page order.
+        """
+
+        self.load_objects([self.root])
+        pages = RE_PAGES.search(self.object_dict(self.root))
+        if not pages:
+            raise RangeNotSupported("PDF catalog without /Pages.")
+
+        # Load page tree level by level
+        level = [int(pages.group(1))]
+        children = {}
+        while level:
+            self.load_objects(level)
+            next_level = []
+            for node in level:
+                content = self.object_dict(node)
+                kids = RE_KIDS.search(content)
+                if kids and not RE_TYPE_PAGE.search(content):
+                    children[node] = [
+                        int(ref[0]) for ref in RE_REF.findall(kids.group(1))
+                    ]
+                    next_level += children[node]
+            level = next_level
+
+        # Pages in order (depth-first)
+        page_objects = []
+        stack = [int(pages.group(1))]
+        while stack:
+            node = stack.pop()
+            if node in children:
+                stack += reversed(children[node])
+            else:
+                page_objects.append(node)
+
+        return page_objects
+
+    def load_pages(self, pages: Iterable[int]) -> None:
+        """
+        Download all objects used by selected pages.
+
+        :param pages: Page numbers (0-based).
+        """
+
+        page_objects = self.get_page_objects()
+        selected = {page_objects[page] for page in pages if page < len(page_objects)}
+        other_pages = set(page_objects) - selected
+
+        # Objects referenced by selected pages (links to other pages are not followed)
+        level = list(selected)
+        seen = selected | other_pages
+        while level:
+            self.load_objects(level)
+            next_level = set()
+            for number in level:
+                next_level |= self.get_refs(number, skip_parent=number in selected)
+            level = list(next_level - seen)
+            seen |= next_level
+
+
+def range_support(headers: Dict[str, str]) -> Tuple[bool, int]:
+    """
+    Return range requests support and size of a remote file from the
+    headers of a response.
+
+    :param headers: Response headers.
+    """
+
+    headers = requests.structures.CaseInsensitiveDict(headers)
+    accept_ranges = headers.get("Accept-Ranges", "").lower() == "bytes"
+    size = int(headers.get("Content-Length", 0))
+
+    return accept_ranges and size > 0, size
+
+
+def probe(url: str, session: requests.Session) -> Tuple[int, bool, int]:
+    """
+    Return HTTP status, range requests support and size of a remote file.
+    HEAD request is used, or GET (body is not read) if HEAD is not allowed.
+
+    :param url: File URL.
+    :param session: Requests session.
+    """
+
+    response = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if response.status_code in HEAD_NOT_ALLOWED:
+        with session.get(url, stream=True, timeout=TIMEOUT) as response:
+            return (response.status_code, *range_support(headers=response.headers))
+
+    return (response.status_code, *range_support(headers=response.headers))
+
+
+def fetch_full(url: str, session: requests.Session) -> Tuple[int, bytes]:
+    """
+    Download full PDF and return HTTP status and content.
+
+    :param url: PDF URL.
+    :param session: Requests session.
+    """
+
+    response = session.get(url, timeout=TIMEOUT)
+    run_ledger.record_response(response=response)
+
+    return response.status_code, response.content
+
+
+def fetch_pdf(
+    url: str,
+    pages: Optional[Iterable[int]] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Tuple[int, bytes]:
+    """
+    Return HTTP status and PDF content. If pages are selected and the
+    server supports range requests, only the objects needed for these
+    pages are downloaded (other bytes are empty), so only selected
+    pages can be read from the returned PDF.
+
+    :param url: PDF URL.
+    :param pages: Page numbers (0-based) to read. Default all pages (full download).
+    :param headers: Headers of a successful probe of the URL (the URL is not probed again).
+    """
+
+    with requests.Session() as session:
+        if pages is None:
+            return fetch_full(url=url, session=session)
+
+        if headers is None:
+            status, accept_ranges, size = probe(url=url, session=session)
+            if status != 200:
+                return status, b""
+        else:
+            accept_ranges, size = range_support(headers=headers)
+        if not accept_ranges:
+            print("Server doesn't support range requests. Downloading full PDF...")
+            return fetch_full(url=url, session=session)
+
+        try:
+            pdf = RemotePDF(url=url, size=size, session=session)
+            pdf.read(0, HEADER_SIZE - 1)
+            tail = pdf.read(max(size - TAIL_SIZE, 0), size - 1)
+            startxref = RE_STARTXREF.findall(tail)
+            if not startxref:
+                raise RangeNotSupported("PDF without startxref.")
+
+            xref_offset, visited = int(startxref[-1]), set()
+            while xref_offset is not None and xref_offset not in visited:
+                visited.add(xref_offset)
+                xref_offset = pdf.read_xref(offset=xref_offset)
+            pdf.boundaries = sorted(set(pdf.boundaries) | set(pdf.offsets.values()))
+
+            pdf.load_pages(pages=pages)
+            print(
+                f"Downloaded {pdf.fetched} of {size} bytes ({100 * pdf.fetched / size:.1f}%) using range requests."
+            )
+            return 200, bytes(pdf.buffer)
+        except FullContent as exc:
+            print("Server returned the full PDF for a range request. Using it.")
+            return 200, exc.content
+        except (RangeNotSupported, ValueError, IndexError, KeyError) as exc:
+            print(
+                f"Couldn't read PDF using range requests ({exc}). Downloading full PDF..."
+            )
+            return fetch_full(url=url, session=session)
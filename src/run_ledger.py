@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Run Ledger
+#
+#   Record one row for each extractor run in table
+#   extractor_runs: timings by stage, bytes fetched, HTTP
+#   status, zones parsed, rows written, outcome and the
+#   bulletin content hash.
+#
+#   Usage: python3 run_ledger.py stats [--days 30]
+#          (duration percentiles p50/p95 by source)
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import argparse
+import hashlib
+import json
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import constants as const
+import db_connector as db
+import settings
+
+# ----- CONFIGURATION ----- #
+
+# Run outcomes
+OUTCOME_SUCCESS = "success"  # New danger levels saved
+OUTCOME_NO_CHANGE = "no_change"  # Danger levels already stored
+OUTCOME_UNAVAILABLE = "unavailable"  # BPA report not available (exit code != 0)
+OUTCOME_FAILED = "failed"  # Unexpected error
+
+# Current run
+run = {}
+# Responses can be recorded from several threads (concurrent downloads)
+lock = threading.RLock()
+
+
+def new_run(source: str) -> dict:
+    """
+    Return empty run record.
+
+    :param source: BPA source name. Ex: icgc
+    """
+
+    return {
+        "source": source,
+        "started_at": datetime.now(),
+        "stage_durations": {},
+        "bytes_fetched": None,
+        "http_status": None,
+        "cache_hits": 0,
+        "zones_parsed": 0,
+        "rows_written": 0,
+        "error": None,
+        "content_hash": None,
+        "hash": None,
+    }
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """
+    Record stage duration in current run.
+
+    :param name: Stage name. Ex: fetch, parse, save
+    :param seconds: Stage duration in seconds.
+    """
+
+    if run:
+        run["stage_durations"][name] = round(seconds, 3)
+
+
+def record_content(content: bytes) -> None:
+    """
+    Add bulletin content to the content hash of current run.
+
+    :param content: Bulletin content as bytes.
+    """
+
+    with lock:
+        if run:
+            if run["hash"] is None:
+                run["hash"] = hashlib.sha256()
+            run["hash"].update(content)
+            run["content_hash"] = run["hash"].hexdigest()
+
+
+def record_response(response, bulletin: bool = False) -> None:
+    """
+    Record HTTP response (status and bytes fetched) in current run.
+
+    :param response: Response from requests library.
+    :param bulletin: Response content is the bulletin (added to content hash).
+    """
+
+    with lock:
+        if run:
+            run["http_status"] = response.status_code
+            run["bytes_fetched"] = (run["bytes_fetched"] or 0) + len(response.content)
+            if bulletin and response.status_code == 200:
+                record_content(content=response.content)
+
+
+def record_levels(zones_parsed: int, rows_written: int) -> None:
+    """
+    Record danger levels parsed and saved in current run. Zones with
+    danger level already stored are counted as cache hits.
+
+    :param zones_parsed: Number of zones with danger level in the bulletin.
+    :param rows_written: Number of new danger levels saved.
+    """
+
+    if run:
+        run["zones_parsed"] += zones_parsed
+        run["rows_written"] += rows_written
+        run["cache_hits"] += zones_parsed - rows_written
+
+
+def get_outcome(exc) -> str:
+    """
+    Return outcome of current run.
+
+    :param exc: Exception raised by the extractor (None if there is no exception).
+    """
+
+    if isinstance(exc, SystemExit) and exc.code not in (None, 0):
+        return OUTCOME_UNAVAILABLE
+    if exc is not None and not isinstance(exc, SystemExit):
+        return OUTCOME_FAILED
+    if run["rows_written"]:
+        return OUTCOME_SUCCESS
+
+    return OUTCOME_NO_CHANGE
+
+
+def save_run(outcome: str) -> None:
+    """
+    Save current run in table extractor_runs. Errors are not raised
+    because the run ledger must never break an extraction.
+
+    :param outcome: Run outcome.
+    """
+
+    finished_at = datetime.now()
+    duration = (finished_at - run["started_at"]).total_seconds()
+    print(f"Run outcome: {outcome}. Stages: {run['stage_durations']}")
+    if not settings.RUN_LEDGER_ENABLED:
+        return
+
+    def sql_value(value) -> str:
+        if value is None:
+            return "NULL"
+        if isinstance(value, (int, float)):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    values = [
+        run["source"],
+        socket.gethostname(),
+        run["started_at"],
+        finished_at,
+        round(duration, 3),
+        json.dumps(run["stage_durations"]),
+        run["bytes_fetched"],
+        run["http_status"],
+        run["cache_hits"],
+        run["zones_parsed"],
+        run["rows_written"],
+        outcome,
+        run["error"],
+        run["content_hash"],
+    ]
+    q = (
+        f"INSERT INTO {const.TABLE_EXTRACTOR_RUNS} (source, host, started_at, finished_at, duration_seconds, "
+        "stage_durations, bytes_fetched, http_status, cache_hits, zones_parsed, rows_written, outcome, "
+        f"error, content_hash) VALUES ({', '.join(sql_value(v) for v in values)})"
+    )
+    try:
+        db.update_data(query=q)
+    except Exception as exc:
+        print(
+            f"WARNING: Couldn't save run in run ledger. ERROR: {exc.__cause__ or exc}"
+        )
+
+
+@contextmanager
+def track(source: str):
+    """
+    Track an extractor run and save it in the run ledger at the end.
+
+    :param source: BPA source name. Ex: icgc
+    """
+
+    run.clear()
+    run.update(new_run(source=source))
+    try:
+        yield run
+    except BaseException as exc:
+        if not isinstance(exc, SystemExit):
+            run["error"] = str(exc)
+        save_run(outcome=get_outcome(exc=exc))
+        raise
+    else:
+        save_run(outcome=get_outcome(exc=None))
+    finally:
+        run.clear()
+
+
+def print_stats(days: int) -> None:
+    """
+    Print duration percentiles (p50/p95) and outcomes for each source.
+
+    :param days: Number of days to include.
+    """
+
+    q = f"""SELECT
+                source,
+                COUNT(*),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_seconds),
+                percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_seconds),
+                COUNT(*) FILTER (WHERE outcome = '{OUTCOME_NO_CHANGE}'),
+                COUNT(*) FILTER (WHERE outcome IN ('{OUTCOME_FAILED}', '{OUTCOME_UNAVAILABLE}'))
+            FROM
+                {const.TABLE_EXTRACTOR_RUNS}
+            WHERE
+                started_at >= now() - interval '{days} days'
+            GROUP BY
+                source
+            ORDER BY
+                source"""
+
+    print(f"Extractor runs in the last {days} days:")
+    print(
+        f"{'source':<16}{'runs':>6}{'p50 (s)':>10}{'p95 (s)':>10}{'no change':>11}{'failed':>8}"
+    )
+    for source, runs, p50, p95, no_change, failed in db.select_data(query=q):
+        print(
+            f"{source:<16}{runs:>6}{p50:>10.2f}{p95:>10.2f}{no_change:>11}{failed:>8}"
+        )
+
+
+def main() -> None:
+    """Show run ledger statistics."""
+
+    parser = argparse.ArgumentParser(description="ATESMaps BPA run ledger")
+    parser.add_argument("command", choices=["stats"])
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    print_stats(days=args.days)
+
+
+if __name__ == "__main__":
+    main()
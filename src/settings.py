@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Settings File
+#
+#   Runtime options for the extractors. Use environment
+#   variables for set values.
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+from os import getenv
+
+# BPA date for extractors that allow past dates. Format: YYYY-MM-DD
+CUSTOM_DATE = getenv("CUSTOM_DATE")
+
+# Extractor run by a backfill job (see bpa_jobs.py): only BPA history and rollups are saved,
+# current danger levels, changes (NOTIFY) and GeoJSON snapshot are not updated.
+BACKFILL = getenv("BPA_BACKFILL", "false").lower() in ("1", "true", "yes")
+
+# Update rollup tables (statistics) on each write.
+# Tables must be created before (resources/SQL/create_bpa_rollup_tables.sql).
+ROLLUPS_ENABLED = getenv("BPA_ROLLUPS", "false").lower() in ("1", "true", "yes")
+
+# Save one row for each extractor run in table extractor_runs.
+# Table must be created before (resources/SQL/create_extractor_runs_table.sql).
+RUN_LEDGER_ENABLED = getenv("BPA_RUN_LEDGER", "false").lower() in ("1", "true", "yes")
+
+# GeoJSON snapshot with current danger levels per zone.
+# If directory is not set, the snapshot will not be generated.
+GEOJSON_SNAPSHOT_DIR = getenv("GEOJSON_SNAPSHOT_DIR")
+# Simplification tolerance in degrees (0 = no simplification)
+GEOJSON_SIMPLIFY_TOLERANCE = float(getenv("GEOJSON_SIMPLIFY_TOLERANCE", "0"))
+# Number of decimal digits for coordinates
+GEOJSON_PRECISION = int(getenv("GEOJSON_PRECISION", "5"))
+# Number of old snapshots to keep in the directory
+GEOJSON_SNAPSHOT_KEEP = int(getenv("GEOJSON_SNAPSHOT_KEEP", "3"))
+
+# Run all extractors even if BPA data is already stored
+FORCE_REFRESH = getenv("FORCE_REFRESH", "false").lower() in ("1", "true", "yes")
+
+# Bulletin season of sources checked by the pre-flight planner (overrides constants.SOURCE_SEASONS).
+# Format: comma separated "source:MM-DD:MM-DD" (start and end). Ex: "icgc:11-01:06-15,aran:12-01:05-15"
+SOURCE_SEASONS = getenv("BPA_SOURCE_SEASONS", "")
+
+# Job queue workers
+JOB_LEASE_SECONDS = int(getenv("JOB_LEASE_SECONDS", "900"))
+JOB_MAX_ATTEMPTS = int(getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = int(
+    getenv("JOB_RETRY_DELAY", "300")
+)  # Seconds (doubled on each retry)
+JOB_POLL_INTERVAL = int(getenv("JOB_POLL_INTERVAL", "30"))  # Seconds
+
+# Profiling of extractor stages (cProfile, tracemalloc and peak RSS).
+# It can also be enabled running the extractor with "--profile" argument.
+PROFILE = getenv("BPA_PROFILE", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = getenv("BPA_PROFILE_DIR", "/tmp/bpa_profiles")
+PROFILE_TOP_ALLOCATIONS = int(getenv("BPA_PROFILE_TOP_ALLOCATIONS", "25"))
+
+# Storage backend for zones and BPA history: postgres (default) or sqlite (embedded database file).
+STORAGE_BACKEND = getenv("BPA_STORAGE", "postgres").lower()
+SQLITE_PATH = getenv("BPA_SQLITE_PATH", "/tmp/bpa.sqlite3")
+# CSV file (columns: zona, codi_zona) with the zones seeded in a new SQLite database.
+# If it's not set, zones are seeded from constants.SOURCE_ZONES with generated codes.
+SQLITE_ZONES_CSV = getenv("BPA_SQLITE_ZONES_CSV")
+
+# Danger level matrix (historical analysis) cache file and max age in seconds (0 = no cache)
+MATRIX_CACHE_PATH = getenv("BPA_MATRIX_CACHE_PATH", "/tmp/bpa_matrix.cache")
+MATRIX_CACHE_MAX_AGE = int(getenv("BPA_MATRIX_CACHE_MAX_AGE", "3600"))
+
+# Date window probed by sources with one bulletin URL for each date (Aran and ICGC):
+# days before and after the current date (or CUSTOM_DATE).
+DATE_WINDOW_BEFORE = int(getenv("BPA_DATE_WINDOW_BEFORE", "1"))
+DATE_WINDOW_AFTER = int(getenv("BPA_DATE_WINDOW_AFTER", "1"))
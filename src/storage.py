@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Storage
+#
+#   Storage backend for zones and BPA history selected with
+#   environment variable BPA_STORAGE:
+#       * postgres: Postgres database (storage_postgres.py).
+#       * sqlite: Embedded SQLite database file with the same
+#                 tables and a seed of zones (storage_sqlite.py).
+#
+#   Each backend module implements the same functions:
+#       * get_zone_ids() -> {zone_name: zone_id}
+#       * bpa_exists(date, zone_id, danger_level) -> bool
+#       * save_levels(levels) -> number of levels saved
+#       * get_history(zone_ids, start, end) -> history records
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import importlib
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import settings
+
+# ----- CONFIGURATION ----- #
+
+# Storage backends and their modules. Modules are imported only when
+# they are used, so SQLite backend doesn't need a Postgres database.
+BACKENDS = {
+    "postgres": "storage_postgres",
+    "sqlite": "storage_sqlite",
+}
+
+
+def get_backend():
+    """
+    Return module of the storage backend selected in settings.
+    """
+
+    if settings.STORAGE_BACKEND not in BACKENDS:
+        raise Exception(
+            f"Unknown storage backend '{settings.STORAGE_BACKEND}'. Available: {', '.join(BACKENDS)}."
+        )
+
+    return importlib.import_module(BACKENDS[settings.STORAGE_BACKEND])
+
+
+def get_zone_ids() -> Dict[str, str]:
+    """
+    Return dictionary with relation between zone and zone ID.
+    """
+
+    return get_backend().get_zone_ids()
+
+
+def bpa_exists(date: str, zone_id: str, danger_level: int) -> bool:
+    """
+    Check if BPA exists for selected date, zone and danger level.
+
+    :param date: The BPA report date in format YYYY-MM-DD.
+    :param zone_id: The zone code that identifies uniquely zone.
+    :param danger_level: Avalanche danger level. Ex: 2
+    """
+
+    return get_backend().bpa_exists(
+        date=date, zone_id=zone_id, danger_level=danger_level
+    )
+
+
+def save_levels(levels: List[Dict]) -> int:
+    """
+    Save danger levels (current level of the zone and BPA history) and
+    return the number of levels saved. Levels already stored are skipped.
+
+    :param levels: List of dictionaries with zone_name, zone_id, date (YYYY-MM-DD) and level.
+    """
+
+    return get_backend().save_levels(levels=levels)
+
+
+def get_history(
+    zone_ids: Optional[List[str]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> List[Tuple[str, str, date, int, datetime]]:
+    """
+    Return BPA history records (zone_id, zone_name, bpa_date, danger_level,
+    created_at) ordered by BPA date, filtered by zone and date range.
+
+    :param zone_ids: Zone codes that identify uniquely zones. Default all zones.
+    :param start: First BPA date in format YYYY-MM-DD.
+    :param end: Last BPA date in format YYYY-MM-DD.
+    """
+
+    return get_backend().get_history(zone_ids=zone_ids, start=start, end=end)
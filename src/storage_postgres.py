@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Postgres Storage
+#
+#   Storage backend with zones (limitszonesbpa) and BPA
+#   history (bpa_history) in the Postgres database. Danger
+#   level changes are published in BPA_CHANGES_CHANNEL and
+#   rollup tables are updated in the same transaction.
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import json
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import bpa_rollups
+import constants as const
+import db_connector as db
+import settings
+
+
+def get_zone_ids() -> Dict[str, str]:
+    """
+    Return dictionary with relation between zone
+    and zone ID.
+    """
+
+    q = f"SELECT zona, codi_zona FROM {const.TABLE_BPA}"
+    response = db.select_data(query=q)
+    zone_ids = {}
+    for rec in response:
+        zone_ids[rec[0]] = rec[1]
+
+    return zone_ids
+
+
+def bpa_exists(date: str, zone_id: str, danger_level: int) -> bool:
+    """
+    Check if BPA exists for selected date and zone.
+
+    :param date: the date you want to validate that there is
+                 an available BPA. Format: YYYY-MM-DD
+    :param zone_id: The code corresponding with the zone that
+                    you want to validate.
+    :param danger_level: Avalanche danger level as string. Ex: 2
+    """
+
+    q = f"""SELECT
+                id
+            FROM
+                {const.TABLE_BPA_HISTORY}
+            WHERE
+                bpa_date = '{date}'
+                and zone_id = '{zone_id}'
+                and danger_level = '{danger_level}'"""
+
+    response = db.select_data(query=q)
+    if response:
+        return True
+
+    return False
+
+
+def get_previous_level(zone_id: str, date: str) -> Optional[int]:
+    """
+    Return the last danger level saved for the zone up to selected
+    date (included). Return None if there is no previous BPA.
+
+    :param zone_id: The zone code that identifies uniquely zone.
+    :param date: The BPA report date in format YYYY-MM-DD.
+    """
+
+    q = f"""SELECT
+                danger_level
+            FROM
+                {const.TABLE_BPA_HISTORY}
+            WHERE
+                zone_id = '{zone_id}'
+                and bpa_date <= '{date}'
+            ORDER BY
+                bpa_date DESC,
+                created_at DESC
+            LIMIT 1"""
+
+    response = db.select_data(query=q)
+    if response:
+        return response[0][0]
+
+    return
+
+
+def get_latest_date(zone_id: str) -> Optional[str]:
+    """
+    Return the newest BPA date saved for the zone in format YYYY-MM-DD.
+    Return None if there is no BPA saved.
+
+    :param zone_id: The zone code that identifies uniquely zone.
+    """
+
+    q = f"SELECT MAX(bpa_date) FROM {const.TABLE_BPA_HISTORY} WHERE zone_id = '{zone_id}'"
+    response = db.select_data(query=q)
+    if response and response[0][0]:
+        return response[0][0].strftime("%Y-%m-%d")
+
+    return
+
+
+def notify_change_query(
+    zone_id: str, date: str, old_level: Optional[int], new_level: int
+) -> str:
+    """
+    Return SQL statement that publishes a danger level change
+    in BPA_CHANGES_CHANNEL (Postgres NOTIFY).
+
+    :param zone_id: The zone code that identifies uniquely zone.
+    :param date: The BPA report date in format YYYY-MM-DD.
+    :param old_level: Previous danger level (None if there is no previous BPA).
+    :param new_level: New danger level.
+    """
+
+    payload = json.dumps(
+        {
+            "zone_id": zone_id,
+            "old_level": old_level,
+            "new_level": new_level,
+            "bpa_date": date,
+        },
+        separators=(",", ":"),
+    ).replace("'", "''")
+
+    return f"SELECT pg_notify('{const.BPA_CHANGES_CHANNEL}', '{payload}')"
+
+
+def save_levels(levels: List[Dict]) -> int:
+    """
+    Save danger levels into database in a single transaction and return
+    the number of levels saved. If danger level changes against the
+    previous BPA of the zone, the change is published in
+    BPA_CHANGES_CHANNEL in the same transaction.
+
+    Current level of the zone is only updated (and changes published)
+    with BPA dates newer or equal than the newest BPA saved for the
+    zone. Older dates and backfill runs (BPA_BACKFILL) only save history
+    and rollups.
+
+    :param levels: List of dictionaries with zone_name, zone_id, date (YYYY-MM-DD) and level.
+    """
+
+    queries = []
+    saved = set()
+    # Last level of each zone added in this transaction: zone_id -> (date, level)
+    batch_levels = {}
+    # Newest BPA date of each zone (saved or added in this transaction)
+    latest_dates = {}
+    for bpa in sorted(levels, key=lambda bpa: bpa["date"]):
+        zone_name, zone_id, date, level = (
+            bpa["zone_name"],
+            bpa["zone_id"],
+            bpa["date"],
+            int(bpa["level"]),
+        )
+        print(
+            f"Adding danger level '{level}' for zone '{zone_name}' using date '{date}' to database..."
+        )
+
+        # Check if BPA data is already saved in the database. Checks of the
+        # write path are done in primary database (no replication lag).
+        if (zone_id, date, level) in saved:
+            print("The BPA data is already in the database. Nothing to do.")
+            continue
+        with db.primary_reads():
+            if bpa_exists(date=date, zone_id=zone_id, danger_level=level):
+                print("The BPA data is already in the database. Nothing to do.")
+                continue
+            previous_level = get_previous_level(zone_id=zone_id, date=date)
+            if zone_id not in latest_dates:
+                latest_dates[zone_id] = get_latest_date(zone_id=zone_id)
+        if zone_id in batch_levels and batch_levels[zone_id][0] <= date:
+            previous_level = batch_levels[zone_id][1]
+        current = not settings.BACKFILL and (
+            latest_dates[zone_id] is None or date >= latest_dates[zone_id]
+        )
+
+        # Insert danger level to BPA table
+        if current:
+            print(f"Updating data to zones information table for zone '{zone_name}'...")
+            queries.append(
+                f"UPDATE {const.TABLE_BPA} SET bpa='{level}', actualitzacio='{datetime.now()}' "
+                f"WHERE codi_zona = '{zone_id}'"
+            )
+            latest_dates[zone_id] = date
+        else:
+            print(
+                f"BPA date '{date}' is not the newest for zone '{zone_name}'. Saving only history."
+            )
+
+        # Insert data into BPA history
+        print(f"Inserting new data to bpa history table for zone '{zone_name}'...")
+        queries.append(
+            f"INSERT INTO {const.TABLE_BPA_HISTORY} (zone_name, zone_id, created_at, danger_level, bpa_date) "
+            f"VALUES ('{zone_name}', '{zone_id}', '{datetime.now()}', '{level}', '{date}')"
+        )
+
+        # Publish danger level change
+        if current and previous_level != level:
+            print(
+                f"Danger level for zone '{zone_name}' changed from '{previous_level}' to '{level}'."
+            )
+            queries.append(
+                notify_change_query(
+                    zone_id=zone_id,
+                    date=date,
+                    old_level=previous_level,
+                    new_level=level,
+                )
+            )
+
+        # Update rollup tables (statistics)
+        if settings.ROLLUPS_ENABLED:
+            queries += bpa_rollups.rollup_queries(
+                zone_name=zone_name, zone_id=zone_id, date=date, level=level
+            )
+
+        saved.add((zone_id, date, level))
+        batch_levels[zone_id] = (date, level)
+
+    if queries:
+        db.update_data_transaction(queries=queries)
+
+    return len(saved)
+
+
+def get_history(
+    zone_ids: Optional[List[str]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> List[Tuple[str, str, date, int, datetime]]:
+    """
+    Return BPA history records (zone_id, zone_name, bpa_date, danger_level,
+    created_at) ordered by BPA date, filtered by zone and date range.
+
+    :param zone_ids: Zone codes that identify uniquely zones. Default all zones.
+    :param start: First BPA date in format YYYY-MM-DD.
+    :param end: Last BPA date in format YYYY-MM-DD.
+    """
+
+    conditions = []
+    if zone_ids:
+        conditions.append("zone_id IN ('{}')".format("', '".join(zone_ids)))
+    if start:
+        conditions.append(f"bpa_date >= '{start}'")
+    if end:
+        conditions.append(f"bpa_date <= '{end}'")
+
+    q = f"""SELECT
+                zone_id,
+                zone_name,
+                bpa_date,
+                danger_level,
+                created_at
+            FROM
+                {const.TABLE_BPA_HISTORY}
+            WHERE
+                {' AND '.join(conditions) or 'TRUE'}
+            ORDER BY
+                bpa_date,
+                zone_id,
+                created_at"""
+
+    return db.select_data(query=q)
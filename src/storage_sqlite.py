@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - SQLite Storage
+#
+#   Storage backend with zones and BPA history in an
+#   embedded SQLite database file (BPA_SQLITE_PATH). The
+#   schema has the same tables and columns as Postgres
+#   (without zone geometries) and it's created with a seed
+#   of zones the first time the file is opened. Useful for
+#   offline deployments and local runs without Postgres.
+#
+#   Danger level changes (NOTIFY) and rollup tables are
+#   only available with Postgres storage.
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import csv
+import sqlite3
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import constants as const
+import settings
+
+# ----- CONFIGURATION ----- #
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {const.TABLE_BPA} (
+    codi_zona TEXT PRIMARY KEY,
+    zona TEXT NOT NULL,
+    bpa TEXT,
+    actualitzacio TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS {const.TABLE_BPA_HISTORY} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TIMESTAMP NOT NULL,
+    zone_name VARCHAR (80) NOT NULL,
+    zone_id VARCHAR (10) NOT NULL,
+    danger_level INT NOT NULL,
+    bpa_date DATE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {const.TABLE_BPA_HISTORY}_zone_date ON {const.TABLE_BPA_HISTORY} (zone_id, bpa_date);
+"""
+
+# Opened database (one connection for each process)
+conn = None
+
+
+def get_seed_zones() -> List[Tuple[str, str]]:
+    """
+    Return (zone_id, zone_name) pairs for a new database. Zones are
+    read from SQLITE_ZONES_CSV (columns zona and codi_zona, same as
+    Postgres zones table) or generated from constants.SOURCE_ZONES.
+    """
+
+    if settings.SQLITE_ZONES_CSV:
+        with open(settings.SQLITE_ZONES_CSV, newline="", encoding="utf-8") as f:
+            return [(row["codi_zona"], row["zona"]) for row in csv.DictReader(f)]
+
+    return [
+        (f"{source}-{index:02d}", zone_name)
+        for source, zones in const.SOURCE_ZONES.items()
+        for index, zone_name in enumerate(zones, start=1)
+    ]
+
+
+def db_conn() -> sqlite3.Connection:
+    """
+    Return opened SQLite database. The schema and the seed of zones
+    are created the first time.
+    """
+
+    global conn
+    if conn is not None:
+        return conn
+
+    try:
+        conn = sqlite3.connect(settings.SQLITE_PATH)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.executescript(SCHEMA)
+            if not conn.execute(f"SELECT COUNT(*) FROM {const.TABLE_BPA}").fetchone()[
+                0
+            ]:
+                print(f"Seeding zones into SQLite database '{settings.SQLITE_PATH}'...")
+                conn.executemany(
+                    f"INSERT INTO {const.TABLE_BPA} (codi_zona, zona) VALUES (?, ?)",
+                    get_seed_zones(),
+                )
+        return conn
+    except Exception as exc:
+        conn = None
+        raise Exception(
+            f"Couldn't open SQLite database '{settings.SQLITE_PATH}'."
+        ) from exc
+
+
+def get_zone_ids() -> Dict[str, str]:
+    """
+    Return dictionary with relation between zone
+    and zone ID.
+    """
+
+    q = f"SELECT zona, codi_zona FROM {const.TABLE_BPA}"
+    return {rec[0]: rec[1] for rec in db_conn().execute(q)}
+
+
+def bpa_exists(date: str, zone_id: str, danger_level: int) -> bool:
+    """
+    Check if BPA exists for selected date and zone.
+
+    :param date: The BPA report date in format YYYY-MM-DD.
+    :param zone_id: The zone code that identifies uniquely zone.
+    :param danger_level: Avalanche danger level. Ex: 2
+    """
+
+    q = f"""SELECT
+                id
+            FROM
+                {const.TABLE_BPA_HISTORY}
+            WHERE
+                bpa_date = ?
+                and zone_id = ?
+                and danger_level = ?
+            LIMIT 1"""
+
+    return (
+        db_conn().execute(q, (date, zone_id, int(danger_level))).fetchone() is not None
+    )
+
+
+def get_latest_date(zone_id: str) -> Optional[str]:
+    """
+    Return the newest BPA date saved for the zone in format YYYY-MM-DD.
+    Return None if there is no BPA saved.
+
+    :param zone_id: The zone code that identifies uniquely zone.
+    """
+
+    q = f"SELECT MAX(bpa_date) FROM {const.TABLE_BPA_HISTORY} WHERE zone_id = ?"
+    return db_conn().execute(q, (zone_id,)).fetchone()[0]
+
+
+def save_levels(levels: List[Dict]) -> int:
+    """
+    Save danger levels into database in a single transaction and return
+    the number of levels saved. Current level of the zone is only
+    updated with BPA dates newer or equal than the newest BPA saved for
+    the zone, and never in backfill runs (BPA_BACKFILL).
+
+    :param levels: List of dictionaries with zone_name, zone_id, date (YYYY-MM-DD) and level.
+    """
+
+    db = db_conn()
+    updates, records = [], []
+    saved = set()
+    # Newest BPA date of each zone (saved or added in this transaction)
+    latest_dates = {}
+    for bpa in sorted(levels, key=lambda bpa: bpa["date"]):
+        zone_name, zone_id, date, level = (
+            bpa["zone_name"],
+            bpa["zone_id"],
+            bpa["date"],
+            int(bpa["level"]),
+        )
+        print(
+            f"Adding danger level '{level}' for zone '{zone_name}' using date '{date}' to database..."
+        )
+        if (zone_id, date, level) in saved or bpa_exists(
+            date=date, zone_id=zone_id, danger_level=level
+        ):
+            print("The BPA data is already in the database. Nothing to do.")
+            continue
+
+        now = datetime.now().isoformat(sep=" ")
+        if zone_id not in latest_dates:
+            latest_dates[zone_id] = get_latest_date(zone_id=zone_id)
+        if not settings.BACKFILL and (
+            latest_dates[zone_id] is None or date >= latest_dates[zone_id]
+        ):
+            updates.append((str(level), now, zone_id))
+            latest_dates[zone_id] = date
+        else:
+            print(
+                f"BPA date '{date}' is not the newest for zone '{zone_name}'. Saving only history."
+            )
+        records.append((zone_name, zone_id, now, level, date))
+        saved.add((zone_id, date, level))
+
+    try:
+        with db:
+            db.executemany(
+                f"UPDATE {const.TABLE_BPA} SET bpa = ?, actualitzacio = ? WHERE codi_zona = ?",
+                updates,
+            )
+            db.executemany(
+                f"INSERT INTO {const.TABLE_BPA_HISTORY} (zone_name, zone_id, created_at, danger_level, bpa_date) "
+                "VALUES (?, ?, ?, ?, ?)",
+                records,
+            )
+    except Exception as exc:
+        raise Exception(
+            "An error occurred saving danger levels into SQLite database."
+        ) from exc
+
+    return len(records)
+
+
+def get_history(
+    zone_ids: Optional[List[str]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> List[Tuple[str, str, date, int, datetime]]:
+    """
+    Return BPA history records (zone_id, zone_name, bpa_date, danger_level,
+    created_at) ordered by BPA date, filtered by zone and date range.
+
+    :param zone_ids: Zone codes that identify uniquely zones. Default all zones.
+    :param start: First BPA date in format YYYY-MM-DD.
+    :param end: Last BPA date in format YYYY-MM-DD.
+    """
+
+    conditions, params = [], []
+    if zone_ids:
+        conditions.append(f"zone_id IN ({', '.join('?' * len(zone_ids))})")
+        params += zone_ids
+    if start:
+        conditions.append("bpa_date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("bpa_date <= ?")
+        params.append(end)
+
+    q = f"""SELECT
+                zone_id,
+                zone_name,
+                bpa_date,
+                danger_level,
+                created_at
+            FROM
+                {const.TABLE_BPA_HISTORY}
+            WHERE
+                {' AND '.join(conditions) or '1'}
+            ORDER BY
+                bpa_date,
+                zone_id,
+                created_at"""
+
+    return [
+        (
+            zone_id,
+            zone_name,
+            date.fromisoformat(bpa_date),
+            level,
+            datetime.fromisoformat(created_at),
+        )
+        for zone_id, zone_name, bpa_date, level, created_at in db_conn().execute(
+            q, params
+        )
+    ]
@@ -0,0 +1,402 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Zone Lookup
+#
+#   Current danger level for a coordinate without querying
+#   the database on each request. Zone limits and current
+#   levels are loaded once (GeoJSON snapshot or database)
+#   into an in-memory spatial index: an R-tree with the
+#   bounding boxes of the polygons (STR bulk loading) and
+#   point-in-polygon tests with edges grouped in latitude
+#   bands. Levels are refreshed with danger level changes
+#   (bpa_listener) or when a new snapshot is generated. If
+#   the listener connection fails, it reconnects with
+#   exponential backoff and the index is reloaded.
+#
+#   Usage: python3 zone_lookup.py LAT LON [LAT LON ...]
+#          [--source snapshot|db]
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import bpa_listener
+import constants as const
+import geojson_snapshot
+import settings
+
+# ----- CONFIGURATION ----- #
+NODE_CAPACITY = 8  # Children of each R-tree node
+EDGES_PER_BAND = 8  # Average edges in each latitude band of a polygon
+MAX_BANDS = 1024  # Max latitude bands for each polygon
+LISTEN_RETRY_DELAY = 1  # Seconds (doubled on each failed reconnection)
+LISTEN_MAX_RETRY_DELAY = 300  # Seconds
+
+# Bounding box: (min_lon, min_lat, max_lon, max_lat)
+BBox = Tuple[float, float, float, float]
+
+
+class Polygon:
+    """
+    Polygon (exterior ring and holes) of a zone with its edges grouped
+    in latitude bands, so a point is only tested against the edges
+    of its band.
+    """
+
+    def __init__(self, rings: List[List[List[float]]], zone_id: str):
+        edges = []
+        for ring in rings:
+            edges += [
+                (x1, y1, x2, y2)
+                for (x1, y1, *_), (x2, y2, *_) in zip(ring, ring[1:] + ring[:1])
+                if y1 != y2
+            ]
+        xs = [point[0] for ring in rings for point in ring]
+        ys = [point[1] for ring in rings for point in ring]
+        self.zone_id = zone_id
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+        # Edges crossing each latitude band
+        self.bands = max(1, min(MAX_BANDS, len(edges) // EDGES_PER_BAND))
+        self.band_height = (self.bbox[3] - self.bbox[1]) / self.bands or 1
+        self.band_edges = [[] for _ in range(self.bands)]
+        for edge in edges:
+            first = self.band(min(edge[1], edge[3]))
+            last = self.band(max(edge[1], edge[3]))
+            for band in range(first, last + 1):
+                self.band_edges[band].append(edge)
+
+    def band(self, lat: float) -> int:
+        """
+        Return latitude band index of a latitude.
+
+        :param lat: Latitude.
+        """
+
+        return min(self.bands - 1, max(0, int((lat - self.bbox[1]) / self.band_height)))
+
+    def contains(self, lon: float, lat: float) -> bool:
+        """
+        Return True if the point is inside the polygon (ray casting,
+        points in holes are outside).
+
+        :param lon: Longitude.
+        :param lat: Latitude.
+        """
+
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+            return False
+
+        inside = False
+        for x1, y1, x2, y2 in self.band_edges[self.band(lat)]:
+            if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (
+                y2 - y1
+            ) + x1:
+                inside = not inside
+
+        return inside
+
+
+def bbox_union(boxes: Iterable[BBox]) -> BBox:
+    """
+    Return bounding box of several bounding boxes.
+
+    :param boxes: Bounding boxes.
+    """
+
+    min_lons, min_lats, max_lons, max_lats = zip(*boxes)
+    return min(min_lons), min(min_lats), max(max_lons), max(max_lats)
+
+
+def build_rtree(polygons: List[Polygon]) -> Optional[Tuple]:
+    """
+    Return root node of an R-tree with the polygons built with
+    Sort-Tile-Recursive (STR) bulk loading. Each node is a tuple
+    (bbox, children, is_leaf) and leaf children are polygons.
+
+    :param polygons: Zone polygons.
+    """
+
+    if not polygons:
+        return
+
+    nodes = [(polygon.bbox, polygon, True) for polygon in polygons]
+    leaf_level = True
+    while len(nodes) > 1 or leaf_level:
+        # Sort by longitude in vertical slices, and by latitude inside each slice
+        groups = math.ceil(len(nodes) / NODE_CAPACITY)
+        slice_size = math.ceil(math.sqrt(groups)) * NODE_CAPACITY
+        nodes.sort(key=lambda node: node[0][0] + node[0][2])
+        parents = []
+        for start in range(0, len(nodes), slice_size):
+            vertical_slice = sorted(
+                nodes[start : start + slice_size],  # noqa: E203
+                key=lambda node: node[0][1] + node[0][3],
+            )
+            for group in range(0, len(vertical_slice), NODE_CAPACITY):
+                children = vertical_slice[group : group + NODE_CAPACITY]  # noqa: E203
+                parents.append(
+                    (
+                        bbox_union(child[0] for child in children),
+                        [child[1] for child in children] if leaf_level else children,
+                        leaf_level,
+                    )
+                )
+        nodes = parents
+        leaf_level = False
+
+    return nodes[0]
+
+
+def get_polygons(feature: Dict) -> List[Polygon]:
+    """
+    Return polygons of a GeoJSON feature (Polygon or MultiPolygon).
+
+    :param feature: GeoJSON feature with zone limits.
+    """
+
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") == "Polygon":
+        parts = [geometry["coordinates"]]
+    elif geometry.get("type") == "MultiPolygon":
+        parts = geometry["coordinates"]
+    else:
+        return []
+
+    zone_id = feature["properties"]["zone_id"]
+    return [
+        Polygon(rings=rings, zone_id=zone_id) for rings in parts if rings and rings[0]
+    ]
+
+
+def load_snapshot_features(
+    snapshot_dir: Optional[str] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Return GeoJSON features and hash of the last GeoJSON snapshot.
+
+    :param snapshot_dir: Directory with the snapshots. Default GEOJSON_SNAPSHOT_DIR.
+    """
+
+    snapshot_dir = snapshot_dir or settings.GEOJSON_SNAPSHOT_DIR
+    if not snapshot_dir:
+        raise Exception(
+            "GeoJSON snapshot directory is not configured (GEOJSON_SNAPSHOT_DIR)."
+        )
+
+    with open(os.path.join(snapshot_dir, const.GEOJSON_SNAPSHOT_LATEST)) as f:
+        latest = json.load(f)
+    with open(os.path.join(snapshot_dir, latest["file"])) as f:
+        collection = json.load(f)
+
+    return collection["features"], latest["hash"]
+
+
+def load_db_features() -> List[Dict]:
+    """
+    Return GeoJSON features with zone limits and current danger level from database.
+    """
+
+    return geojson_snapshot.get_zones_features()
+
+
+class ZoneIndex:
+    """
+    In-memory spatial index with zones and current danger levels.
+    """
+
+    def __init__(self, source: str = "snapshot", snapshot_dir: Optional[str] = None):
+        """
+        :param source: Where zones are loaded from: snapshot (GeoJSON snapshot) or db (database).
+        :param snapshot_dir: Directory with the snapshots. Default GEOJSON_SNAPSHOT_DIR.
+        """
+
+        self.source = source
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_hash = None
+        self.zones = {}  # zone_id -> zone properties
+        self.bpa_dates = {}  # zone_id -> BPA date of the last change applied
+        self.root = None
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Load zones and current danger levels and rebuild the index.
+        """
+
+        try:
+            if self.source == "db":
+                features, snapshot_hash = load_db_features(), None
+            else:
+                features, snapshot_hash = load_snapshot_features(
+                    snapshot_dir=self.snapshot_dir
+                )
+
+            zones, polygons = {}, []
+            for feature in features:
+                zones[feature["properties"]["zone_id"]] = dict(feature["properties"])
+                polygons += get_polygons(feature=feature)
+            root = build_rtree(polygons=polygons)
+        except Exception as exc:
+            raise Exception(
+                f"Couldn't load zones for point lookup from {self.source}."
+            ) from exc
+
+        # Replace index at once (lookups in other threads use the old or the new one)
+        self.zones, self.root, self.snapshot_hash = zones, root, snapshot_hash
+        print(
+            f"Zone lookup index loaded with {len(zones)} zones and {len(polygons)} polygons."
+        )
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Reload zones if there is a new GeoJSON snapshot. Return True
+        if the index has been reloaded.
+        """
+
+        if self.source != "snapshot":
+            return False
+
+        snapshot_dir = self.snapshot_dir or settings.GEOJSON_SNAPSHOT_DIR
+        with open(os.path.join(snapshot_dir, const.GEOJSON_SNAPSHOT_LATEST)) as f:
+            if json.load(f)["hash"] == self.snapshot_hash:
+                return False
+
+        self.refresh()
+        return True
+
+    def apply_change(self, change: Dict) -> None:
+        """
+        Update current danger level of a zone with a danger level
+        change published by the extractors (see bpa_listener). Changes
+        older than the last change applied to the zone are ignored.
+
+        :param change: Danger level change payload.
+        """
+
+        zone = self.zones.get(change["zone_id"])
+        if zone is None:
+            return
+        bpa_date = self.bpa_dates.get(change["zone_id"])
+        if bpa_date and change["bpa_date"] < bpa_date:
+            print(
+                f"Ignoring change for zone '{change['zone_id']}' with date '{change['bpa_date']}' "
+                f"(older than '{bpa_date}')."
+            )
+            return
+        self.bpa_dates[change["zone_id"]] = change["bpa_date"]
+        zone["danger_level"] = change["new_level"]
+        zone["updated_at"] = datetime.now().isoformat(timespec="seconds")
+
+    def listen_changes(self) -> None:
+        """
+        Apply danger level changes forever. If the connection fails, the
+        error is logged and the listener reconnects with exponential
+        backoff. The index is reloaded after each reconnection (changes
+        published while disconnected are not received).
+        """
+
+        delay, reconnecting = LISTEN_RETRY_DELAY, False
+
+        def on_listen() -> None:
+            nonlocal delay
+            delay = LISTEN_RETRY_DELAY
+            if reconnecting:
+                self.refresh()
+
+        while True:
+            try:
+                bpa_listener.listen(callback=self.apply_change, on_listen=on_listen)
+            except Exception as exc:
+                print(f"WARNING: Danger level changes listener failed. ERROR: {exc}")
+            print(f"Reconnecting danger level changes listener in {delay} seconds...")
+            time.sleep(delay)
+            delay, reconnecting = min(delay * 2, LISTEN_MAX_RETRY_DELAY), True
+
+    def follow_changes(self) -> threading.Thread:
+        """
+        Apply danger level changes in a background thread (Postgres LISTEN).
+        """
+
+        thread = threading.Thread(target=self.listen_changes, daemon=True)
+        thread.start()
+        return thread
+
+    def lookup(self, lat: float, lon: float) -> Optional[Dict]:
+        """
+        Return zone properties (zone_id, zone_name, danger_level and
+        updated_at) for a coordinate. Return None if the point is not
+        inside any zone.
+
+        :param lat: Latitude (WGS84).
+        :param lon: Longitude (WGS84).
+        """
+
+        if self.root is None:
+            return
+
+        zones, stack = self.zones, [self.root]
+        while stack:
+            (min_lon, min_lat, max_lon, max_lat), children, is_leaf = stack.pop()
+            if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+                continue
+            if not is_leaf:
+                stack += children
+                continue
+            for polygon in children:
+                if polygon.contains(lon=lon, lat=lat):
+                    return zones.get(polygon.zone_id)
+
+        return
+
+    def lookup_many(
+        self, points: Iterable[Tuple[float, float]]
+    ) -> List[Optional[Dict]]:
+        """
+        Return zone properties for each coordinate (see lookup).
+
+        :param points: Coordinates (lat, lon).
+        """
+
+        return [self.lookup(lat=lat, lon=lon) for lat, lon in points]
+
+
+def main() -> None:
+    """Print current danger level for coordinates."""
+
+    parser = argparse.ArgumentParser(description="ATESMaps BPA zone lookup")
+    parser.add_argument(
+        "coordinates", nargs="+", type=float, help="Coordinates: LAT LON [LAT LON ...]"
+    )
+    parser.add_argument("--source", choices=["snapshot", "db"], default="snapshot")
+    args = parser.parse_args()
+    if len(args.coordinates) % 2:
+        parser.error("Coordinates must be pairs of latitude and longitude.")
+
+    index = ZoneIndex(source=args.source)
+    points = list(zip(args.coordinates[::2], args.coordinates[1::2]))
+    for (lat, lon), zone in zip(points, index.lookup_many(points=points)):
+        if zone:
+            print(
+                f"{lat}, {lon}: zone '{zone['zone_name']}' ({zone['zone_id']}) danger level {zone['danger_level']}"
+            )
+        else:
+            print(f"{lat}, {lon}: outside BPA zones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+############################################################
+#
+#   ATESMaps - BPA Extractors - Remote PDF Tests
+#
+#   Tests of remote_pdf with a local HTTP server: range
+#   reads of selected pages, fallback to full download
+#   (cross-reference streams, servers without range or
+#   HEAD support) and missing files.
+#
+#   Usage: python3 -m unittest discover tests
+#
+#   Collaborators:
+#       * Nil Torrano: <ntorrano@atesmaps.org>
+#       * Atesmaps Team: <info@atesmaps.org>
+#
+#   November 2021
+#
+############################################################
+import os
+import re
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pymupdf
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import remote_pdf  # noqa: E402
+
+# ----- CONFIGURATION ----- #
+PAGES = 8
+PAGE_TEXT = "Zone {page} - Danger level {page}"
+IMAGE_SIZE = 160  # Pixels of a random image on each page (pages bigger than MERGE_GAP)
+
+
+def build_pdf(xref_streams: bool = False) -> bytes:
+    """
+    Return a PDF with one text page for each zone.
+
+    :param xref_streams: Use cross-reference streams (compressed objects).
+    """
+
+    doc = pymupdf.open()
+    for page_number in range(PAGES):
+        page = doc.new_page()
+        page.insert_text((72, 72), PAGE_TEXT.format(page=page_number))
+        noise = pymupdf.Pixmap(
+            pymupdf.csGRAY, IMAGE_SIZE, IMAGE_SIZE, os.urandom(IMAGE_SIZE**2), False
+        )
+        page.insert_image(
+            pymupdf.Rect(72, 100, 72 + IMAGE_SIZE, 100 + IMAGE_SIZE), pixmap=noise
+        )
+    content = doc.tobytes(expand=255, use_objstms=int(xref_streams))
+    doc.close()
+
+    return content
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    HTTP handler for the files in server.files. Range requests and
+    HEAD requests can be disabled with server.ranges and server.head.
+    """
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_file(self, body: bool) -> None:
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match and self.server.ranges:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+            self.server.range_requests += 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+            content = content[start : end + 1]  # noqa: E203
+            self.server.bytes_sent += len(content) if body else 0
+        else:
+            self.server.full_requests += body
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+    def do_HEAD(self) -> None:
+        if not self.server.head:
+            self.send_error(405)
+            return
+        self.send_file(body=False)
+
+    def do_GET(self) -> None:
+        self.send_file(body=True)
+
+
+class RemotePDFTest(unittest.TestCase):
+    """
+    remote_pdf.fetch_pdf against a local HTTP server.
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.classic = build_pdf()
+        cls.xref_streams = build_pdf(xref_streams=True)
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        cls.server.files = {
+            "/classic.pdf": cls.classic,
+            "/xref_streams.pdf": cls.xref_streams,
+        }
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        self.server.ranges, self.server.head = True, True
+        (
+            self.server.range_requests,
+            self.server.full_requests,
+            self.server.bytes_sent,
+        ) = (0, 0, 0)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def page_text(self, content: bytes, page: int) -> str:
+        with pymupdf.open(stream=content, filetype="pdf") as doc:
+            return doc[page].get_text("text")
+
+    def test_range_reads(self) -> None:
+        status, content = remote_pdf.fetch_pdf(
+            url=self.url("/classic.pdf"), pages=[1, 2]
+        )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(content), len(self.classic))
+        self.assertNotEqual(content, self.classic)
+        self.assertGreater(self.server.range_requests, 0)
+        self.assertLess(self.server.bytes_sent, len(self.classic))
+        self.assertEqual(self.server.full_requests, 0)
+        self.assertIn(PAGE_TEXT.format(page=1), self.page_text(content=content, page=1))
+        self.assertIn(PAGE_TEXT.format(page=2), self.page_text(content=content, page=2))
+
+    def test_range_reads_with_probe_headers(self) -> None:
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(len(self.classic))}
+        status, content = remote_pdf.fetch_pdf(
+            url=self.url("/classic.pdf"), pages=[3], headers=headers
+        )
+
+        self.assertEqual(status, 200)
+        self.assertIn(PAGE_TEXT.format(page=3), self.page_text(content=content, page=3))
+
+    def test_xref_streams_fallback(self) -> None:
+        status, content = remote_pdf.fetch_pdf(
+            url=self.url("/xref_streams.pdf"), pages=[1]
+        )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(content, self.xref_streams)
+        self.assertEqual(self.server.full_requests, 1)
+
+    def test_full_content_for_range_request(self) -> None:
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(len(self.classic))}
+        self.server.ranges = False
+        status, content = remote_pdf.fetch_pdf(
+            url=self.url("/classic.pdf"), pages=[1], headers=headers
+        )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(content, self.classic)
+        self.assertEqual(self.server.full_requests, 1)
+
+    def test_no_range_support(self) -> None:
+        self.server.ranges = False
+        status, content = remote_pdf.fetch_pdf(url=self.url("/classic.pdf"), pages=[1])
+
+        self.assertEqual(status, 200)
+        self.assertEqual(content, self.classic)
+        self.assertEqual(self.server.full_requests, 1)
+
+    def test_head_not_allowed(self) -> None:
+        self.server.head = False
+        status, content = remote_pdf.fetch_pdf(url=self.url("/classic.pdf"), pages=[1])
+
+        self.assertEqual(status, 200)
+        self.assertIn(PAGE_TEXT.format(page=1), self.page_text(content=content, page=1))
+
+    def test_not_found(self) -> None:
+        self.assertEqual(
+            remote_pdf.fetch_pdf(url=self.url("/missing.pdf"), pages=[1]), (404, b"")
+        )
+        self.assertEqual(remote_pdf.fetch_pdf(url=self.url("/missing.pdf"))[0], 404)
+
+
+if __name__ == "__main__":
+    unittest.main()